@@ -0,0 +1,265 @@
+# Benchmarks for the sorting hot path, run from the repository root with
+#     python -m benchmarks.bench --files 2000 --output bench.json
+# Every stage works on a synthetic corpus generated in a temporary directory,
+# results are printed (or written) as a single JSON document
+from lib.datatypes import InstanceConfig, SieveMode, DuplicateMode, PreviewQuality, SortOrder
+from lib.indexer import SourceIndex
+from lib.destindex import DestinationIndex
+from lib.preview import load_preview
+from lib.thumbcache import ThumbnailCache
+from lib.router import Router
+from lib.fileops import FileOpQueue
+from PIL import Image, ImageFilter
+import argparse
+import contextlib
+import json
+import os
+from os import path
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import types
+
+FORMATS = { "jpeg": ".jpg", "png": ".png", "tiff": ".tif" }
+FORMAT_WEIGHTS = { "jpeg": 8, "png": 1, "tiff": 1 }
+"""Mostly camera JPEGs, like the real sources"""
+SAVE_OPTIONS = { "jpeg": {"quality": 90}, "png": {}, "tiff": {"compression": "tiff_deflate"} }
+RESOLUTIONS = [(640,480),(1920,1080),(4000,3000)]
+
+def make_corpus(directory:str, count:int, collision_dir:str | None = None,
+        collision_rate:float = 0.1, resolutions = RESOLUTIONS, seed:int = 0) -> dict:
+    """
+    Fill directory with count images named IMG_00001.ext..., randomly mixing formats
+    (weighted by FORMAT_WEIGHTS) and resolutions.
+    Only one template per format and resolution is actually encoded, the rest are copies,
+    so that even huge corpora are quick to generate.
+    If collision_dir is given, a collision_rate fraction of the names is also created there
+    """
+    rng = random.Random(seed)
+    os.makedirs(directory,exist_ok=True)
+    templates = []
+    for size in resolutions:
+        # smooth noise compresses like a real photo, unlike flat colours
+        base = Image.effect_noise((size[0]//8,size[1]//8),64).convert("RGB").resize(size).filter(ImageFilter.GaussianBlur(2))
+        for name,extension in FORMATS.items():
+            template = path.join(directory,f".template_{size[0]}x{size[1]}{extension}")
+            base.save(template,format=name,**SAVE_OPTIONS[name])
+            templates.append((template,FORMAT_WEIGHTS[name]))
+
+    total_bytes = 0
+    choices = rng.choices([t for t,_ in templates],weights=[w for _,w in templates],k=count)
+    for i,template in enumerate(choices):
+        target = path.join(directory,f"IMG_{i:05d}{path.splitext(template)[1]}")
+        shutil.copyfile(template,target)
+        total_bytes += os.path.getsize(target)
+        if collision_dir is not None and rng.random() < collision_rate:
+            open(path.join(collision_dir,path.basename(target)),"wb").close()
+    for template,_ in templates: os.remove(template)
+    return {"files": count, "bytes": total_bytes, "resolutions": [list(r) for r in resolutions], "formats": list(FORMATS)}
+
+def percentiles(samples:list[float]) -> dict:
+    """p50/p95/max of a list of seconds, in milliseconds"""
+    if not samples: return {}
+    ordered = sorted(samples)
+    return {
+        "p50_ms": round(statistics.median(ordered) * 1000,3),
+        "p95_ms": round(ordered[min(len(ordered)-1,int(len(ordered)*0.95))] * 1000,3),
+        "max_ms": round(ordered[-1] * 1000,3),
+    }
+
+def bench_indexing(source:str) -> dict:
+    start = time.perf_counter()
+    index = SourceIndex(source)
+    index.wait_for_any()
+    first = time.perf_counter() - start
+    index.wait()
+    elapsed = time.perf_counter() - start
+    sort_start = time.perf_counter()
+    index.ordered_indices(SortOrder.NEWEST_FIRST)
+    return {
+        "files": index.count,
+        "first_entry_ms": round(first * 1000,3),
+        "scan_seconds": round(elapsed,4),
+        "sort_seconds": round(time.perf_counter() - sort_start,4),
+        "files_per_second": round(index.count / elapsed,1) if elapsed else None,
+    }
+
+def bench_decode(source:str, sample:int, width:int) -> dict:
+    """Preview decode/resize throughput per quality, plus the preview cache cold and warm"""
+    files = sorted(os.listdir(source))[:sample]
+    results = {}
+    for quality in PreviewQuality:
+        times = []
+        for f in files:
+            start = time.perf_counter()
+            load_preview(path.join(source,f),width,quality)
+            times.append(time.perf_counter() - start)
+        results[quality.value] = {"images": len(times), "images_per_second": round(len(times)/sum(times),1), **percentiles(times)}
+
+    cache = ThumbnailCache(tempfile.mkdtemp(prefix="visieve-bench-cache-"))
+    for label in ("cache_cold","cache_warm"):
+        times = []
+        for f in files:
+            filepath = path.join(source,f)
+            start = time.perf_counter()
+            image = cache.get(filepath,str(width))
+            if image is None:
+                image = load_preview(filepath,width,PreviewQuality.EXACT)
+                cache.put(filepath,str(width),image)
+            times.append(time.perf_counter() - start)
+        results[label] = {"images": len(times), "images_per_second": round(len(times)/sum(times),1), **percentiles(times)}
+    cache.close()
+    shutil.rmtree(cache.directory,ignore_errors=True)
+    return results
+
+def bench_file_ops(corpus:str, collisions:str, workdir:str) -> dict:
+    """Throughput of routing + copying/moving the whole corpus, for every mode combination"""
+    results = {}
+    for sieve_mode in SieveMode:
+        for duplicate_mode in DuplicateMode:
+            if duplicate_mode in (DuplicateMode.HALT,DuplicateMode.SKIP_IDENTICAL): continue # crashes / needs hashing
+            label = f"{sieve_mode.value}/{duplicate_mode.value}"
+            run_dir = path.join(workdir,label.replace("/","_").replace(" ","_"))
+            source = path.join(run_dir,"source")
+            dest = path.join(run_dir,"dest")
+            shutil.copytree(corpus,source) # MOVE consumes its source
+            shutil.copytree(collisions,dest)
+            config = InstanceConfig(source,{"a":dest},sieve_mode,duplicate_mode,cache_dir=None,journal_dir=None)
+
+            files = sorted(os.listdir(source))
+            total_bytes = sum(os.path.getsize(path.join(source,f)) for f in files)
+            router = Router(config,DestinationIndex([dest]))
+            queue = FileOpQueue()
+            decide_times = []
+            start = time.perf_counter()
+            for f in files:
+                t = time.perf_counter()
+                op = router.route(path.join(source,f),dest)
+                if op is not None: queue.submit(op)
+                decide_times.append(time.perf_counter() - t)
+            queue.close()
+            elapsed = time.perf_counter() - start
+            results[label] = {
+                "files": len(files),
+                "seconds": round(elapsed,4),
+                "files_per_second": round(len(files)/elapsed,1),
+                "mb_per_second": round(total_bytes/1024**2/elapsed,1),
+                "failures": len(queue.failures),
+                "keypress_decision": percentiles(decide_times),
+            }
+            shutil.rmtree(run_dir,ignore_errors=True)
+    return results
+
+def bench_dialog(corpus:str, workdir:str, presses:int) -> dict:
+    """
+    Keypress-to-display latency of the real SortingDialog. Needs a display
+    (a virtual one like Xvfb is fine), the stage is skipped otherwise
+    """
+    import tkinter as tk
+    from lib import sorter
+    try:
+        tk.Tk().destroy()
+    except tk.TclError as e:
+        return {"skipped": f"no display available ({e})"}
+
+    source = path.join(workdir,"dialog_source")
+    dest = path.join(workdir,"dialog_dest")
+    shutil.copytree(corpus,source)
+    os.makedirs(dest)
+    config = InstanceConfig(source,{"a":dest},SieveMode.COPY,DuplicateMode.ASSIGN_UNIQUE_NAME,cache_dir=None,journal_dir=None)
+    latencies = []
+    first_image = []
+
+    class TimedDialog(sorter.SortingDialog):
+        """Presses "a" as soon as each image is on screen, and measures how long the next one takes"""
+        def __init__(self, config):
+            self._created = time.perf_counter()
+            self._pressed = None
+            super().__init__(config)
+        def _show_next_image(self):
+            super()._show_next_image()
+            if self.current_img_path is None: return # still waiting, will be called again
+            now = time.perf_counter()
+            if self._pressed is None: first_image.append(now - self._created)
+            else: latencies.append(now - self._pressed)
+            if len(latencies) >= presses:
+                self._quit()
+                return
+            self.window.after(1,self._press)
+        def _press(self):
+            self._pressed = time.perf_counter()
+            self.handle_keypress(types.SimpleNamespace(keysym="a"))
+
+    try:
+        TimedDialog(config)
+    except SystemExit:
+        pass # the dialog exits once the source runs out
+    shutil.rmtree(source,ignore_errors=True)
+    shutil.rmtree(dest,ignore_errors=True)
+    return {
+        "presses": len(latencies),
+        "first_image_ms": round(first_image[0]*1000,3) if first_image else None,
+        **percentiles(latencies),
+    }
+
+STAGES = ["indexing","decode","file_ops","dialog"]
+
+def main():
+    parser = argparse.ArgumentParser(description="Visieve hot path benchmarks")
+    parser.add_argument("--files",type=int,default=500,help="size of the synthetic corpus")
+    parser.add_argument("--resolutions",default=",".join(f"{w}x{h}" for w,h in RESOLUTIONS),
+        help="comma separated WxH list, e.g. 64x48 for huge indexing-only corpora or 6000x4000 for decoding")
+    parser.add_argument("--sample",type=int,default=48,help="images decoded by the decode stage")
+    parser.add_argument("--presses",type=int,default=50,help="keypresses simulated by the dialog stage")
+    parser.add_argument("--width",type=int,default=600,help="preview width")
+    parser.add_argument("--collision-rate",type=float,default=0.1,help="fraction of names already in the destination")
+    parser.add_argument("--stages",default=",".join(STAGES),help="comma separated subset of "+", ".join(STAGES))
+    parser.add_argument("--workdir",default=None,help="where to generate the corpus (a temporary directory by default)")
+    parser.add_argument("--output",default=None,help="JSON file to write, stdout by default")
+    args = parser.parse_args()
+    stages = [s for s in args.stages.split(",") if s]
+    for s in stages:
+        if s not in STAGES: parser.error(f"unknown stage {s}")
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="visieve-bench-")
+    corpus = path.join(workdir,"corpus")
+    collisions = path.join(workdir,"collisions")
+    os.makedirs(collisions,exist_ok=True)
+    start = time.perf_counter()
+    resolutions = [tuple(int(v) for v in r.split("x")) for r in args.resolutions.split(",")]
+    corpus_info = make_corpus(corpus,args.files,collisions,args.collision_rate,resolutions)
+    corpus_info["generation_seconds"] = round(time.perf_counter() - start,3)
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "pillow": Image.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "corpus": corpus_info,
+        "results": {},
+    }
+    for stage in stages:
+        print(f"Running {stage}...",file=sys.stderr)
+        # visieve logs every operation on stdout, keep it clean for the JSON report
+        with contextlib.redirect_stdout(sys.stderr):
+            match stage:
+                case "indexing": result = bench_indexing(corpus)
+                case "decode": result = bench_decode(corpus,args.sample,args.width)
+                case "file_ops": result = bench_file_ops(corpus,collisions,workdir)
+                case "dialog": result = bench_dialog(corpus,workdir,args.presses)
+        report["results"][stage] = result
+
+    if args.workdir is None: shutil.rmtree(workdir,ignore_errors=True)
+    output = json.dumps(report,indent=2)
+    if args.output:
+        with open(args.output,"w") as f: f.write(output)
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+# run from the repository root: python -m featuretest.claimtest
+# several operators sort one source at once, one of them crashes while holding leases
+from multiprocessing import Process
+from lib.claims import Claims
+import os, shutil, sys, tempfile, time
+
+FILES = 200
+OPERATORS = 4
+LEASE = 2.0
+
+def operator(source:str, dest:str, name:str, crash:bool):
+    claims = Claims(source,LEASE,name)
+    for _ in range(2): # the second pass picks up the leases of the crashed operator
+        for filename in sorted(os.listdir(source)):
+            filepath = os.path.join(source,filename)
+            if not os.path.isfile(filepath) or not claims.claim(filepath): continue
+            if crash:
+                os._exit(1) # one lease held, never renewed nor released
+            time.sleep(0.005) # looking at the image
+            claims.done(filepath)
+            shutil.copy(filepath,os.path.join(dest,f"{filename}.{name}"))
+        time.sleep(LEASE * 1.5)
+    claims.close()
+
+if __name__ == "__main__":
+    root = tempfile.mkdtemp()
+    source,dest = os.path.join(root,"source"),os.path.join(root,"dest")
+    os.makedirs(source)
+    os.makedirs(dest)
+    for i in range(FILES):
+        with open(os.path.join(source,f"IMG_{i:04}.jpg"),"wb") as f: f.write(os.urandom(64))
+
+    processes = [ Process(target=operator,args=(source,dest,f"op{i}",i == 0)) for i in range(OPERATORS) ]
+    start = time.perf_counter()
+    for p in processes: p.start()
+    for p in processes: p.join()
+    print(f"{OPERATORS} operators sorted {FILES} files in {time.perf_counter() - start:.1f}s")
+
+    sorted_by: dict[str,list[str]] = {}
+    for filename in os.listdir(dest):
+        image,op = filename.rsplit(".",1)
+        sorted_by.setdefault(image,[]).append(op)
+    for op in sorted({ o for ops in sorted_by.values() for o in ops }):
+        print(f"  {op}: {sum(ops.count(op) for ops in sorted_by.values())}")
+    twice = [ image for image,ops in sorted_by.items() if len(ops) > 1 ]
+    missing = FILES - len(sorted_by)
+    print("Sorted twice:",twice or "none")
+    print("Never sorted:",missing)
+    shutil.rmtree(root)
+    sys.exit(1 if twice or missing else 0)
@@ -1,5 +1,7 @@
+# run from the repository root: python -m featuretest.videotest
 from tkinter import *
-from tkvideo import tkvideo
+from PIL import ImageTk
+from lib.video import VideoPlayer
 
 def_size = (700,500)
 
@@ -12,8 +14,17 @@ root.title('Video Player')
 Label(text="Space lore").pack()
 video_label = Label(root)
 video_label.pack()
-# read video to display on label
-player = tkvideo("example/afreightdata/afreightc.avi", video_label,
-                 loop = 1, size = def_size)
-player.play()
-root.mainloop()
\ No newline at end of file
+# frames get decoded on a background thread, the Tk loop only polls them
+player = VideoPlayer("example/afreightdata/afreightc.avi", def_size[0], fps=25)
+
+def show_frame():
+    frame = player.frame()
+    if frame is not None:
+        img = ImageTk.PhotoImage(frame)
+        video_label.configure(image=img)
+        video_label.image = img
+    root.after(player.interval_ms, show_frame)
+
+show_frame()
+root.mainloop()
+player.stop()
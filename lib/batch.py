@@ -0,0 +1,216 @@
+from .datatypes import InstanceConfig, SieveMode, DuplicateMode, PreviewQuality, SortOrder
+from .indexer import SourceIndex
+from .destindex import DestinationIndex
+from .router import Router
+from .fileops import FileOperation, transfer
+from .hashing import ContentIndex, HashCache
+from .exif import read_header
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, fields
+from functools import partial
+import csv
+import json
+import os
+from os import path
+import time
+
+ENUM_FIELDS = {
+    "sieve_mode": SieveMode,
+    "duplicate_mode": DuplicateMode,
+    "preview_quality": PreviewQuality,
+    "order": SortOrder,
+}
+"""InstanceConfig fields that hold enums, written in config files by their value (e.g. "copy")"""
+
+@dataclass
+class Rule:
+    """
+    Routing rule for the batch mode: a file goes to key if it satisfies every condition set.
+    Sizes are in bytes, dimensions in pixels, extensions are compared case-insensitively
+    """
+    key: str
+    extensions: list[str] | None = None
+    min_size: int | None = None
+    max_size: int | None = None
+    min_width: int | None = None
+    max_width: int | None = None
+    min_height: int | None = None
+    max_height: int | None = None
+    exif: dict[str,str] = field(default_factory=dict)
+    """EXIF field names (as in PIL.ExifTags.TAGS) and the value they must have"""
+
+    def needs_header(self) -> bool:
+        """True if the image header has to be read to evaluate this rule"""
+        dims = (self.min_width,self.max_width,self.min_height,self.max_height)
+        return bool(self.exif) or any(d is not None for d in dims)
+
+    def matches(self, filepath:str, size:int, header: dict | None) -> bool:
+        if self.extensions is not None:
+            extension = path.splitext(filepath)[1].lower()
+            if extension not in { e.lower() for e in self.extensions }: return False
+        if self.min_size is not None and size < self.min_size: return False
+        if self.max_size is not None and size > self.max_size: return False
+        if not self.needs_header(): return True
+        if header is None: return False # unreadable image
+
+        width,height = header["size"]
+        if self.min_width is not None and width < self.min_width: return False
+        if self.max_width is not None and width > self.max_width: return False
+        if self.min_height is not None and height < self.min_height: return False
+        if self.max_height is not None and height > self.max_height: return False
+        for name,value in self.exif.items():
+            if str(header["exif"].get(name)).strip() != str(value): return False
+        return True
+
+def load_labels(label_file:str, source:str) -> dict[str,str]:
+    """
+    Reads a CSV of path,key lines (e.g. the output of a classifier).
+    Paths can be absolute or relative to source, the result is keyed by absolute path
+    """
+    labels = {}
+    with open(label_file,newline="") as f:
+        for row in csv.reader(f):
+            if len(row) < 2 or not row[0].strip(): continue
+            filepath = row[0].strip()
+            if not path.isabs(filepath): filepath = path.join(source,filepath)
+            labels[path.abspath(filepath)] = row[1].strip()
+    return labels
+
+def load_config(config_file:str) -> tuple[InstanceConfig,list[Rule],dict[str,str]]:
+    """
+    Reads a JSON config file: the InstanceConfig fields (enums by value),
+    plus an optional list of "rules" and an optional "labels" CSV file
+    """
+    with open(config_file) as f:
+        raw = json.load(f)
+
+    rules = [ Rule(**r) for r in raw.pop("rules",[]) ]
+    label_file = raw.pop("labels",None)
+    known = { f.name for f in fields(InstanceConfig) }
+    unknown = set(raw) - known
+    if unknown: raise ValueError(f"Unknown config fields: {', '.join(sorted(unknown))}")
+    for name,enum in ENUM_FIELDS.items():
+        if name in raw: raw[name] = enum(raw[name])
+    for name in ("size","grid"):
+        if raw.get(name) is not None: raw[name] = tuple(raw[name])
+    config = InstanceConfig(**raw)
+
+    for rule in rules:
+        if rule.key not in config.dest: raise ValueError(f"Rule key {rule.key} is not bound to a destination")
+    labels = {}
+    if label_file is not None:
+        if not path.isabs(label_file): label_file = path.join(path.dirname(config_file),label_file)
+        labels = load_labels(label_file,config.source)
+    return config,rules,labels
+
+def classify(entry:tuple[str,int], rules:list[Rule], labels:dict[str,str]) -> str | None:
+    """Key a (path, size) entry goes to, or None to leave it for manual sorting. Runs in worker processes"""
+    filepath,size = entry
+    key = labels.get(path.abspath(filepath))
+    if key is not None: return key
+    header = read_header(filepath) if any(r.needs_header() for r in rules) else None
+    for rule in rules:
+        if rule.matches(filepath,size,header): return rule.key
+    return None
+
+def _run(op:FileOperation, verify:bool = False) -> str | None:
+    """Carry out op (and its mirrors) in a worker process, returns the error message if it fails"""
+    try:
+        transfer(op,verify)
+        return None
+    except Exception as e:
+        return str(e)
+
+def _rounds(ops:list[FileOperation]) -> list[list[FileOperation]]:
+    """
+    Split ops so that no round writes the same destination twice (only happens with OVERWRITE).
+    Running the rounds one after the other keeps the last writer winning, like in the sorting window
+    """
+    rounds = []
+    seen: dict[str,int] = {}
+    for op in ops:
+        n = max(seen.get(t.destination,0) for t in op.targets())
+        for t in op.targets(): seen[t.destination] = n + 1
+        if n == len(rounds): rounds.append([])
+        rounds[n].append(op)
+    return rounds
+
+def run_batch(
+        config: InstanceConfig,
+        rules: list[Rule],
+        labels: dict[str,str] | None = None,
+        dry_run: bool = False,
+        workers: int | None = None) -> dict:
+    """
+    Sieve the whole source without a window: every file is classified by the labels and rules
+    on a process pool, names are decided in this process (so duplicates are handled exactly
+    like in the sorting window), then the transfers run on the pool.
+    Files no rule matches are left in place. Returns a summary of the run
+    """
+    validity = config.is_valid()
+    if validity is not True: raise ValueError(validity)
+    labels = labels or {}
+    start = time.perf_counter()
+
+    index = SourceIndex(config.source,config.recursive,videos=config.videos,exclude=config.destination_dirs())
+    index.wait()
+    entries = list(zip(index.paths,index.sizes))
+    scanned = len(entries)
+    if config.duplicate_mode is DuplicateMode.SKIP_IDENTICAL:
+        # identical files are dropped before classification, exactly like the sorting window does
+        hash_location = None
+        if config.cache_dir is not None: hash_location = path.join(config.cache_dir,"hashes.sqlite")
+        content = ContentIndex(config.destination_dirs(),HashCache(hash_location))
+        unique = set(content.unique_paths(entries))
+        content.close()
+        entries = [ e for e in entries if e[0] in unique ]
+    router = Router(config,DestinationIndex(config.destination_dirs()))
+
+    summary = {
+        "scanned": scanned, "matched": 0, "skipped": scanned - len(entries), "failed": 0,
+        "bytes": 0, "per_key": { k:0 for k in config.dest }, "dry_run": dry_run,
+    }
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        chunksize = max(1,len(entries) // ((workers or os.cpu_count() or 1) * 8))
+        keys = pool.map(partial(classify,rules=rules,labels=labels),entries,chunksize=chunksize)
+
+        ops = []
+        for (filepath,size),key in zip(entries,keys):
+            if key is None: continue
+            summary["matched"] += 1
+            op = router.route(filepath,config.dest[key])
+            if op is None:
+                summary["skipped"] += 1
+                continue
+            op.size = size
+            summary["per_key"][key] += 1
+            summary["bytes"] += size
+            ops.append(op)
+            if dry_run: print(f"{op.mode.value}: {op.source} -> {' + '.join(t.destination for t in op.targets())}")
+        classified_at = time.perf_counter()
+
+        if not dry_run:
+            for batch in _rounds(ops):
+                run = partial(_run,verify=config.verify_copies)
+                for op,error in zip(batch,pool.map(run,batch,chunksize=max(1,chunksize // 4))):
+                    if error is not None:
+                        summary["failed"] += 1
+                        print(f"Could not {op.mode.value} {op.source} into {op.destination}: {error}")
+
+    elapsed = time.perf_counter() - start
+    summary["classify_seconds"] = round(classified_at - start,3)
+    summary["seconds"] = round(elapsed,3)
+    summary["files_per_second"] = round(summary["scanned"] / elapsed,1) if elapsed else None
+    summary["mb_per_second"] = round(summary["bytes"] / 1024**2 / elapsed,1) if elapsed and not dry_run else None
+    return summary
+
+def print_summary(summary:dict):
+    """Human readable version of the dictionary returned by run_batch"""
+    print("Dry run, nothing was copied or moved" if summary["dry_run"] else "Batch done")
+    print(f"Scanned {summary['scanned']} images, {summary['matched']} matched a rule, "
+          f"{summary['skipped']} skipped as duplicates, {summary['failed']} failed")
+    for key,count in summary["per_key"].items():
+        print(f"  {key}: {count}")
+    print(f"{summary['bytes'] / 1024**2:.1f} MB in {summary['seconds']} s "
+          f"(classification {summary['classify_seconds']} s), {summary['files_per_second']} files/s"
+          + (f", {summary['mb_per_second']} MB/s" if summary["mb_per_second"] is not None else ""))
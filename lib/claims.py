@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+from os import path
+import queue
+import socket
+import threading
+import time
+
+CLAIMS_DIR = ".visieve-claims"
+"""Folder inside the source holding the lease and done files shared by every operator"""
+
+class Claims:
+    """
+    Coordinates several sorting windows (possibly on different machines) working on the same source.
+    A file is only shown by the operator holding its lease: a file in the CLAIMS_DIR of the source,
+    created with O_CREAT | O_EXCL so that exactly one operator gets it. Held leases are renewed
+    (their mtime touched) every lease/3 seconds, a lease older than lease seconds belongs to
+    a crashed client and can be taken over. Once sorted, a file gets a done marker instead,
+    so that copies are never sorted twice. Markers are written by the thread renewing the leases,
+    in the order they were asked for, so a slow share never holds up the caller
+    """
+
+    def __init__(self, source:str, lease:float = 60, operator:str | None = None) -> None:
+        self.source = path.abspath(source)
+        self.directory = path.join(self.source,CLAIMS_DIR)
+        os.makedirs(self.directory,exist_ok=True)
+        self.lease = lease
+        self.operator = operator or f"{socket.gethostname()}-{os.getpid()}"
+        self.skipped = 0 # files left out because another operator has them
+        self._held: dict[str,int] = {} # source path -> inode of our lease file
+        self.lost: set[str] = set() # leases taken over by someone else while we held them
+        self._lock = threading.Lock()
+        self._marks = queue.Queue() # (done or undo, path) for the renewer, None to stop it
+        self._heartbeat = threading.Thread(target=self._renew_loop,daemon=True,name="visieve-claims")
+        self._heartbeat.start()
+
+    def _name(self, filepath:str) -> str:
+        relative = path.relpath(path.abspath(filepath),self.source)
+        return path.join(self.directory,hashlib.sha1(relative.encode()).hexdigest())
+
+    def _create_lease(self, filepath:str, lease_file:str) -> bool:
+        try:
+            fd = os.open(lease_file,os.O_CREAT | os.O_EXCL | os.O_WRONLY,0o644)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd,"w") as f:
+            json.dump({"operator":self.operator,"path":path.abspath(filepath),"time":time.time()},f)
+        with self._lock:
+            self._held[filepath] = os.stat(lease_file).st_ino
+        return True
+
+    def claim(self, filepath:str) -> bool:
+        """Try to get the lease of filepath, False if it's sorted already or another operator holds it"""
+        name = self._name(filepath)
+        if path.exists(name + ".done"): return False
+        if not self._take(filepath,name + ".lease"): return False
+        # its owner may have sorted it and released the lease between the check above and now
+        if path.exists(name + ".done"):
+            self.release(filepath)
+            return False
+        return True
+
+    def _take(self, filepath:str, lease_file:str) -> bool:
+        """Create the lease, or take it over if it expired"""
+        if self._create_lease(filepath,lease_file): return True
+        # taken, unless its owner stopped renewing it
+        stale = f"{lease_file}.stale-{self.operator}-{time.time_ns()}"
+        try:
+            expired = os.stat(lease_file)
+            if time.time() - expired.st_mtime < self.lease: return False
+            os.rename(lease_file,stale)
+            moved = os.stat(stale)
+        except OSError:
+            return False
+        if (moved.st_ino,moved.st_mtime_ns) != (expired.st_ino,expired.st_mtime_ns):
+            # stat and rename aren't atomic together: another contender took over the expired lease
+            # in between (or its owner renewed it), and that fresh lease is what got moved, so put it back
+            try:
+                os.link(stale,lease_file)
+            except OSError:
+                pass # yet another lease is there already, the owner of this one will notice it lost it
+            os.remove(stale)
+            return False
+        os.remove(stale)
+        # leftovers of contenders that died mid-takeover. A fresh lease some contender moved by mistake
+        # is never old enough to go: it's about to be put back
+        for leftover in [ f for f in os.listdir(self.directory) if f.startswith(path.basename(lease_file) + ".stale-") ]:
+            try:
+                leftover = path.join(self.directory,leftover)
+                if time.time() - os.stat(leftover).st_mtime >= self.lease: os.remove(leftover)
+            except OSError:
+                pass
+        print(f"Taking over the expired lease of {filepath}")
+        return self._create_lease(filepath,lease_file)
+
+    def claim_group(self, group:list[str]) -> list[str]:
+        """The files of group this operator got the lease of"""
+        claimed = [ p for p in group if self.claim(p) ]
+        self.skipped += len(group) - len(claimed)
+        return claimed
+
+    def done(self, filepath:str):
+        """filepath is sorted: nobody is to claim it again. The marker is written in the background"""
+        self._marks.put((self._write_done,filepath))
+
+    def undo(self, filepath:str):
+        """Take back done(): the file is ours again, until it gets sorted anew"""
+        self._marks.put((self._take_back,filepath))
+
+    def _write_done(self, filepath:str):
+        with open(self._name(filepath) + ".done","w") as f: f.write(self.operator)
+        self.release(filepath)
+
+    def _take_back(self, filepath:str):
+        name = self._name(filepath)
+        self._create_lease(filepath,name + ".lease")
+        try:
+            os.remove(name + ".done")
+        except FileNotFoundError:
+            pass
+
+    def release(self, filepath:str):
+        """Give up the lease of filepath, so that another operator can take it right away"""
+        with self._lock:
+            inode = self._held.pop(filepath,None)
+        if inode is None: return
+        lease_file = self._name(filepath) + ".lease"
+        try:
+            if os.stat(lease_file).st_ino == inode: os.remove(lease_file)
+        except OSError:
+            pass
+
+    def _renew_loop(self):
+        """Write the markers as they come, renew the leases every lease/3 seconds in between"""
+        renewal = time.monotonic() + self.lease / 3
+        while True:
+            if time.monotonic() >= renewal:
+                self._renew()
+                renewal = time.monotonic() + self.lease / 3
+            try:
+                mark = self._marks.get(timeout=max(0,renewal - time.monotonic()))
+            except queue.Empty:
+                continue
+            if mark is None: return
+            write,filepath = mark
+            try:
+                write(filepath)
+            except OSError as e:
+                print(f"Could not update the claim of {filepath}: {e}")
+
+    def _renew(self):
+        with self._lock:
+            held = list(self._held.items())
+        for filepath,inode in held:
+            lease_file = self._name(filepath) + ".lease"
+            try:
+                # a lease taken over by someone else is a different file under the same name
+                if os.stat(lease_file).st_ino != inode: raise FileNotFoundError
+                os.utime(lease_file)
+            except OSError:
+                print(f"Lost the lease of {filepath}, another operator took it over")
+                with self._lock:
+                    self._held.pop(filepath,None)
+                    self.lost.add(filepath)
+
+    def close(self):
+        """Write the pending markers, stop renewing and release every lease still held"""
+        self._marks.put(None)
+        self._heartbeat.join()
+        with self._lock:
+            held = list(self._held)
+        for filepath in held: self.release(filepath)
@@ -1,7 +1,9 @@
 from enum import Enum
 import os
 from os import path
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from .thumbcache import default_cache_dir
+from .destindex import DestinationIndex
 
 VALID_KEYS = r"1234567890abcdefghijklmnopqrtuvwxyz"
 
@@ -22,16 +24,110 @@ class DuplicateMode(Enum):
     """Attempt to add a numeric suffix that distinguishes the new file"""
     HALT = "halt"
     """Send an error message to the user and crash the program"""
+    SKIP_IDENTICAL = "skip identical content"
+    """
+    Compare contents instead of names: files identical to one already in a destination
+    (or earlier in the source) are skipped without being shown,
+    different files that share a name get a numeric suffix
+    """
+
+class PreviewQuality(Enum):
+    """Trade-off between speed and fidelity when rendering previews"""
+    FAST = "fast"
+    """Let the codec and integer reduction do most of the work, finish with a cheap filter"""
+    EXACT = "exact"
+    """Only shrink in the codec as far as it is lossless to the eye, finish with a bicubic filter"""
+
+class SortOrder(Enum):
+    """Order in which the source images are shown"""
+    NEWEST_FIRST = "newest first"
+    """By modification time, newest first. Needs the whole source to be scanned first"""
+    SCAN = "directory order"
+    """In the order the directory listing returns them, images appear while the scan is still running"""
+    CAPTURE_TIME = "capture time"
+    """
+    Oldest first by EXIF DateTimeOriginal, read from the headers while the source is scanned.
+    Files without one use their modification time
+    """
+    NAME = "name"
+    """Natural order of the paths (IMG_9 before IMG_10)"""
+    LARGEST_FIRST = "largest first"
+    """By file size, largest first"""
 
 
 @dataclass
 class InstanceConfig:
     """Configuration data needed for sorting"""
     source:str
-    dest: dict[str,str]
+    dest: dict[str,str | list[str]]
+    """Folder bound to each key, or several folders: the file goes into the first one, copies into the others"""
     sieve_mode: SieveMode = SieveMode.COPY
     duplicate_mode: DuplicateMode = DuplicateMode.ASSIGN_UNIQUE_NAME
     size:tuple[int,int] = (600,600)
+    order: SortOrder = SortOrder.NEWEST_FIRST
+    recursive: bool = False
+    """Also sort the images found in the subdirectories of source"""
+    preview_quality: PreviewQuality = PreviewQuality.EXACT
+    prefetch_depth:int = 4
+    """How many images get decoded ahead of the one on screen"""
+    prefetch_memory:int = 256 * 1024**2
+    """Upper bound (in bytes) for the decoded images waiting in the look-ahead queue"""
+    cache_dir:str | None = field(default_factory=default_cache_dir)
+    """Directory of the persistent preview cache, None disables it"""
+    cache_budget:int = 1024**3
+    """Disk space (in bytes) the preview cache may use before evicting old previews"""
+    max_inflight_bytes:int = 512 * 1024**2
+    """Upper bound (in bytes) for the files being copied or moved at the same time"""
+    timing:bool = False
+    """Record per-stage timings, shown by the overlay (F2) of the sorting window"""
+    timing_export:str | None = None
+    """File the timings get written to at the end of the session (.json, or CSV otherwise)"""
+    journal_dir:str | None = field(default_factory=lambda: path.join(default_cache_dir(),"journals"))
+    """Directory of the session journals used to resume interrupted sessions, None disables them"""
+    resume:bool = True
+    """Continue the journaled session with the same source, destinations and mode, False starts a new one"""
+    group_bursts:bool = False
+    """Hash the images ahead of sorting and show runs of near-identical ones as a single group (needs NumPy)"""
+    burst_threshold:int = 6
+    """Maximum number of differing hash bits for two images to be grouped"""
+    burst_hash:str = "dhash"
+    """Perceptual hash used for grouping: ahash, dhash or phash"""
+    videos:bool = True
+    """Sort videos too, previewed by a few keyframes (needs OpenCV, ignored without it)"""
+    video_playback:bool = False
+    """Play the video on screen in a low frame rate loop instead of showing its keyframes"""
+    video_keyframes:int = 3
+    """Keyframes shown side by side as the preview of a video"""
+    watch:bool = False
+    """Keep the window open and sort the files that appear in the source, as soon as they are complete"""
+    watch_polling:bool = False
+    """Watch the source by listing it periodically instead of using inotify (for network shares)"""
+    watch_interval:float = 1.0
+    """Seconds between two listings of the source, when polling"""
+    watch_settle:float = 2.0
+    """Seconds a new file's size must stay the same before it gets sorted, when polling"""
+    grid:tuple[int,int] | None = None
+    """Columns and rows of the contact sheet shown by the grid mode, None shows one image at a time"""
+    undo_depth:int = 50
+    """Keypresses that can be taken back with BackSpace or Ctrl+Z, 0 disables undo"""
+    undo_memory:int = 128 * 1024**2
+    """Memory (in bytes) kept for the previews of recently sorted images, so going back needs no decoding"""
+    zoom_memory:int = 256 * 1024**2
+    """Memory (in bytes) for the decoded tiles of zoomed in images"""
+    verify_copies:bool = False
+    """Read every copy back and compare its checksum with the source's, mismatching copies are removed and reported"""
+    shared:bool = False
+    """
+    Several operators (windows, possibly on other machines) sort the same source together:
+    every file is claimed through a lease file in the source before it's shown, so each one is seen once
+    """
+    operator:str | None = None
+    """
+    Name of this operator when sharing the source, keeps the journals of operators on one machine apart.
+    Without it the host name and process id are used, and the session can't be resumed
+    """
+    lease_seconds:float = 60.0
+    """Leases not renewed for this long belong to a crashed operator, and are taken over"""
 
     def is_valid(self) -> bool | str:
         """Verify whether this configuration actually represents a working setting"""
@@ -39,8 +135,11 @@ class InstanceConfig:
         if self.source is None: return "Source dir is None"
         if not path.exists(self.source): return "Non existent source dir"
         if self.dest is None: return "Destination dictionary is None"
-        for _,dest in self.dest.items():
+        if any(not self.targets(key) for key in self.dest): return "Key bound to no destination dir"
+        for dest in self.destination_dirs():
             if not path.exists(dest): return "Non existent destination dir"
+        if self.grid is not None and (len(self.grid) != 2 or min(self.grid) < 1): return "Invalid grid size"
+        if self.group_bursts and not 0 <= self.burst_threshold < 64: return "Invalid burst threshold"
         return True
 
     def get_size_string(self) -> str:
@@ -48,12 +147,25 @@ class InstanceConfig:
         width, height = self.size
         return f"{width}x{height}"
 
-    def are_destinations_empty(self) -> bool:
-        """Returns True if all of the destinations directories are empty"""
-        for _,dirpath in self.dest.items():
-            if os.listdir(dirpath): return False
+    def are_destinations_empty(self, index: DestinationIndex | None = None) -> bool:
+        """
+        Returns True if all of the destinations directories are empty.
+        If index is given, its listings are used (and filled) instead of listing the directories again
+        """
+        if index is None: index = DestinationIndex()
+        for dirpath in self.destination_dirs():
+            if not index.is_empty(dirpath): return False
         return True
 
+    def targets(self, key:str) -> list[str]:
+        """Folders bound to key"""
+        dest = self.dest[key]
+        return [dest] if isinstance(dest,str) else list(dest)
+
+    def destination_dirs(self) -> list[str]:
+        """Every destination folder, of every key"""
+        return [ d for key in self.dest for d in self.targets(key) ]
+
     def is_source_empty(self) -> bool:
         """Returns True if the source directory is empty"""
         return not os.listdir(self.source)
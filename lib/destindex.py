@@ -0,0 +1,71 @@
+from typing import Iterable
+import os
+from os import path
+import threading
+
+class DestinationIndex:
+    """
+    In memory copy of the file names present in the destination directories.
+    Each directory is listed once (the first time it's needed), after that
+    the names visieve writes get added as they are decided, so name conflicts
+    are solved without touching the filesystem
+    """
+
+    def __init__(self, directories: Iterable[str] = ()) -> None:
+        self._names: dict[str,set[str]] = {}
+        self._next_suffix: dict[tuple[str,str,str],int] = {} # (dir, stem, extension) -> first suffix to try
+        self._lock = threading.Lock() # directories may get listed in the background, e.g. at startup
+        for directory in directories: self._listing(directory)
+
+    @staticmethod
+    def _key(directory:str) -> str:
+        return path.normcase(path.abspath(directory))
+
+    def _listing(self, directory:str) -> set[str]:
+        """Names in directory, listed from disk only the first time"""
+        key = self._key(directory)
+        names = self._names.get(key)
+        if names is None:
+            with self._lock:
+                names = self._names.get(key)
+                if names is None:
+                    with os.scandir(directory) as entries:
+                        names = { path.normcase(e.name) for e in entries }
+                    self._names[key] = names
+        return names
+
+    def exists(self, filepath:str) -> bool:
+        """True if filepath existed when its directory was listed, or has been added since"""
+        directory, name = path.split(filepath)
+        return path.normcase(name) in self._listing(directory)
+
+    def is_empty(self, directory:str) -> bool:
+        return not self._listing(directory)
+
+    def add(self, filepath:str):
+        """Record that a file is going to be written at filepath"""
+        directory, name = path.split(filepath)
+        self._listing(directory).add(path.normcase(name))
+
+    def discard(self, filepath:str):
+        """Record that the file at filepath is gone"""
+        directory, name = path.split(filepath)
+        self._listing(directory).discard(path.normcase(name))
+
+    def unique_name(self, filepath:str) -> str:
+        """
+        Returns filepath if it's free, otherwise the first free "name(n).ext" variant.
+        The next suffix to try is remembered per name, so thousands of collisions
+        on the same name don't mean thousands of probes each
+        """
+        if not self.exists(filepath): return filepath
+        directory, name = path.split(filepath)
+        stem, extension = path.splitext(name)
+        key = (self._key(directory),stem,extension)
+        counter = self._next_suffix.get(key,1)
+        while True:
+            candidate = path.join(directory,f"{stem}({counter}){extension}")
+            counter += 1
+            if not self.exists(candidate): break
+        self._next_suffix[key] = counter
+        return candidate
@@ -0,0 +1,72 @@
+from .preview import open_image
+from .sqlitecache import SQLiteCache
+from PIL import ExifTags
+from os import path
+import time
+
+EXIF_IFD = 0x8769
+"""Sub-IFD holding most of the camera fields (DateTimeOriginal, ExposureTime...)"""
+DATETIME = 0x0132
+"""Last modification of the file by the camera or an editor, in IFD0"""
+DATETIME_ORIGINAL = 0x9003
+SUBSEC_TIME_ORIGINAL = 0x9291
+
+def _parse(value) -> float | None:
+    """Seconds since the epoch of an EXIF "YYYY:MM:DD HH:MM:SS" string (local time, like the camera clock)"""
+    if not isinstance(value,str): return None
+    try:
+        return time.mktime(time.strptime(value.strip("\0 ")[:19],"%Y:%m:%d %H:%M:%S"))
+    except (ValueError,OverflowError):
+        return None # "0000:00:00 00:00:00" and other placeholders
+
+def read_capture_time(filepath:str) -> float | None:
+    """
+    DateTimeOriginal (with its sub-seconds) of the image at filepath, or DateTime if it's missing.
+    Only the header is read, the pixels are never decoded
+    """
+    try:
+        with open_image(filepath) as image_file:
+            exif = image_file.getexif()
+            details = exif.get_ifd(EXIF_IFD)
+            captured = _parse(details.get(DATETIME_ORIGINAL))
+            if captured is None: return _parse(exif.get(DATETIME))
+            subsec = str(details.get(SUBSEC_TIME_ORIGINAL,"")).strip("\0 ")
+            if subsec.isdigit(): captured += int(subsec) / 10**len(subsec)
+            return captured
+    except Exception:
+        return None # not an image Pillow can read the header of (e.g. videos), or a broken one
+
+def read_header(filepath:str) -> dict | None:
+    """Size and EXIF fields (by name) of an image, without decoding its pixels"""
+    try:
+        with open_image(filepath) as image_file:
+            exif = image_file.getexif()
+            tags = dict(exif)
+            tags.update(exif.get_ifd(EXIF_IFD))
+            return {
+                "size": image_file.size,
+                "exif": { ExifTags.TAGS.get(k,str(k)): v for k,v in tags.items() },
+            }
+    except Exception:
+        return None
+
+class CaptureTimeCache:
+    """
+    Persistent capture times. Files without one are remembered too, so their headers aren't parsed again.
+    None as the location keeps them in memory only
+    """
+
+    def __init__(self, location: str | None = None) -> None:
+        self._store = SQLiteCache(location,"captured",["time REAL"])
+
+    def capture_time(self, filepath:str, mtime:float, size:int) -> float | None:
+        """Capture time of filepath, from the cache if its mtime and size didn't change"""
+        key = (path.abspath(filepath),mtime,size)
+        row = self._store.get(key,"time")
+        if row is not None: return row[0]
+        value = read_capture_time(filepath)
+        self._store.set(key,"time",value)
+        return value
+
+    def close(self):
+        self._store.close()
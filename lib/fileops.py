@@ -0,0 +1,443 @@
+from .datatypes import SieveMode
+from .hashing import _digest
+from .timing import StageTimer, DISABLED
+from dataclasses import dataclass, field
+import errno
+import hashlib
+import os
+import queue
+import shutil
+import threading
+from typing import Callable
+
+try:
+    import fcntl # reflinks are only attempted where ioctl is available
+except ImportError:
+    fcntl = None
+
+FICLONE = 0x40049409
+"""Linux ioctl that makes dst share src's extents (btrfs, xfs, bcachefs...)"""
+COPY_CHUNK = 1024**3
+TRASH_DIR = ".visieve-trash"
+"""Folder (inside each destination) where overwritten files are kept until they can't be restored anymore"""
+FANOUT_BUFFER = 64 * 1024**2
+"""Sources up to this size are read once into memory and written from there to every target of a fan-out"""
+
+@dataclass
+class FileOperation:
+    """A single copy or move requested by the user"""
+    source: str
+    destination: str
+    """Full path of the final file, name conflicts are already solved"""
+    mode: SieveMode
+    size: int = 0
+    backup: str | None = None
+    """Where the file about to be overwritten at destination gets set aside, if it has to be restorable"""
+    undo: bool = False
+    """Reverse the operation instead of carrying it out"""
+    mirrors: list["FileOperation"] = field(default_factory=list)
+    """Copies of source into the other folders of a key bound to several (fan-out), made from the same read"""
+
+    def targets(self) -> list["FileOperation"]:
+        """The operation itself and its mirrors"""
+        return [self,*self.mirrors]
+
+    def reversed(self) -> "FileOperation":
+        """The operation that undoes this one"""
+        return FileOperation(
+            self.source,self.destination,self.mode,self.size,self.backup,
+            undo=True,mirrors=[ m.reversed() for m in self.mirrors ]
+        )
+
+def _reflink(src, dst) -> bool:
+    """Try to clone src into dst without copying any data"""
+    if fcntl is None: return False
+    try:
+        fcntl.ioctl(dst.fileno(),FICLONE,src.fileno())
+        return True
+    except OSError:
+        return False
+
+def _copy_range(src, dst) -> bool:
+    """
+    Try to copy src into dst inside the kernel, letting the filesystem offload it if possible.
+    False unless all of it got copied: some FUSE and NFS mounts report end of file right away
+    """
+    if not hasattr(os,"copy_file_range"): return False
+    try:
+        size = os.fstat(src.fileno()).st_size
+        copied = 0
+        while (n := os.copy_file_range(src.fileno(),dst.fileno(),COPY_CHUNK)) > 0:
+            copied += n
+        return copied == size
+    except OSError:
+        # unsupported by the filesystems involved (EXDEV, EINVAL, ENOSYS...)
+        return False
+
+def copy_file(source:str, destination:str):
+    """
+    Same result as shutil.copy2, but tries a reflink and then copy_file_range first.
+    The final fallback is shutil.copyfile, which already uses sendfile/fcopyfile where available
+    """
+    with open(source,"rb") as src, open(destination,"wb") as dst:
+        done = _reflink(src,dst) or _copy_range(src,dst)
+    if not done:
+        shutil.copyfile(source,destination) # starts over, so partial fast copies don't matter
+    shutil.copystat(source,destination)
+
+def move_file(source:str, destination:str):
+    """
+    Rename source into destination if they are on the same device (constant time),
+    copy and delete it otherwise
+    """
+    try:
+        same_device = os.stat(source).st_dev == os.stat(os.path.dirname(os.path.abspath(destination))).st_dev
+    except OSError:
+        same_device = False
+    if same_device:
+        try:
+            os.replace(source,destination)
+            return
+        except OSError as e:
+            # e.g. bind mounts of different filesystems, which report the same device
+            if e.errno != errno.EXDEV: raise
+    copy_file(source,destination)
+    os.remove(source)
+
+def _link(source:str, destination:str) -> bool:
+    """Hard link source at destination (replacing it), False across devices or where links aren't supported"""
+    temporary = destination + ".visieve-link"
+    try:
+        os.link(source,temporary)
+    except OSError:
+        return False
+    os.replace(temporary,destination)
+    return True
+
+def _set_aside(op: FileOperation):
+    """Move the file op is about to overwrite into its backup, if it has one"""
+    if op.backup is None: return
+    try:
+        os.makedirs(os.path.dirname(op.backup),exist_ok=True)
+        os.replace(op.destination,op.backup) # same folder tree, so a plain rename
+    except FileNotFoundError:
+        op.backup = None # nothing was there to overwrite after all
+
+def transfer(op: FileOperation, verify:bool = False):
+    """
+    Actually perform the copy or move described by op (or reverse it).
+    Operations with mirrors (or to be verified) go through a FanOut, one target after the other
+    """
+    if op.mirrors or verify:
+        fan_out = FanOut(op,verify)
+        for target in op.targets():
+            error = None
+            try:
+                fan_out.write(target)
+            except Exception as e:
+                error = e
+            if fan_out.finish(error) and fan_out.error is None: fan_out.complete()
+        if fan_out.error is not None: raise fan_out.error
+        return
+    if op.undo: return revert(op)
+    _set_aside(op)
+    match op.mode:
+        case SieveMode.COPY:
+            copy_file(op.source,op.destination)
+        case SieveMode.MOVE:
+            move_file(op.source,op.destination)
+        case _:
+            raise ValueError(f"Sieve mode {op.mode} is not supported")
+
+def revert(op: FileOperation):
+    """Undo a finished copy or move: drop the copy or move the file back, then restore what it overwrote"""
+    match op.mode:
+        case SieveMode.COPY:
+            os.remove(op.destination)
+        case SieveMode.MOVE:
+            try:
+                linked = os.path.samefile(op.destination,op.source)
+            except OSError:
+                linked = False
+            # a fan-out MOVE that never completed: the destination is still a hard link of the source
+            if linked: os.remove(op.destination)
+            else: move_file(op.destination,op.source)
+        case _:
+            raise ValueError(f"Sieve mode {op.mode} is not supported")
+    if op.backup is not None and os.path.exists(op.backup):
+        os.replace(op.backup,op.destination)
+        try:
+            os.rmdir(os.path.dirname(op.backup)) # only succeeds once the trash is empty
+        except OSError:
+            pass
+
+def discard_backup(op: FileOperation):
+    """Delete the files op (and its mirrors) set aside, once they can no longer be restored"""
+    for target in op.targets():
+        if target.backup is None: continue
+        try:
+            os.remove(target.backup)
+            os.rmdir(os.path.dirname(target.backup)) # only succeeds once the trash is empty
+        except OSError:
+            pass
+
+class FanOut:
+    """
+    An operation being written to each of its targets (itself and its mirrors), possibly by different threads.
+    The source is read (and hashed, when verifying) once, by whichever target needs it first:
+    small sources are kept in memory for the others, big ones are copied by the kernel for each target.
+    The target of a MOVE is a hard link when it's on the same device, the source goes once every target is written
+    """
+
+    def __init__(self, op: FileOperation, verify:bool = False, after: "FanOut | None" = None) -> None:
+        self.op = op
+        self.verify = verify
+        self.after = after
+        """Fan-out to be over before any target of this one starts (the operation this one reverses)"""
+        self.left = len(op.targets())
+        self.error: Exception | None = None
+        """First error met by a target, a MOVE keeps its source if there is one"""
+        self.finished = threading.Event()
+        """Set once every target is written (and the source of a MOVE removed), or skipped"""
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._data: bytes | None = None
+        self._checksum: str | None = None
+
+    def _load(self):
+        with self._lock:
+            if self._loaded: return
+            if self.op.size <= FANOUT_BUFFER:
+                with open(self.op.source,"rb") as f: self._data = f.read()
+                if self.verify: self._checksum = hashlib.blake2b(self._data,digest_size=16).hexdigest()
+            elif self.verify:
+                self._checksum = _digest(self.op.source)
+            self._loaded = True
+
+    def write(self, target: FileOperation):
+        """Write (or revert) one of the targets"""
+        if target.undo: return revert(target)
+        _set_aside(target)
+        if target is self.op and target.mode is SieveMode.MOVE and _link(target.source,target.destination): return
+        self._load()
+        if self._data is None:
+            copy_file(target.source,target.destination)
+        else:
+            with open(target.destination,"wb") as f: f.write(self._data)
+            shutil.copystat(target.source,target.destination)
+        if self.verify and _digest(target.destination) != self._checksum:
+            os.remove(target.destination)
+            raise OSError(f"Checksum mismatch, the copy at {target.destination} was removed")
+
+    def finish(self, error: Exception | None) -> bool:
+        """Count a target as written (or failed), True for the last one"""
+        with self._lock:
+            self.left -= 1
+            if self.error is None: self.error = error
+            if self.left == 0: self._data = None
+            return self.left == 0
+
+    def skip(self) -> bool:
+        """Count a target of a withdrawn operation, True for the last one"""
+        with self._lock:
+            self.left -= 1
+            if self.left == 0: self.finished.set()
+            return self.left == 0
+
+    def complete(self):
+        """Once every target is written: a MOVE removes its source"""
+        if self.op.mode is SieveMode.MOVE and not self.op.undo:
+            try:
+                os.remove(self.op.source)
+            except Exception as e:
+                self.error = e
+                raise
+
+class FileOpQueue:
+    """
+    Runs file operations on background threads, one thread per destination device
+    so that operations towards the same folder happen in the order they were submitted,
+    a slow device (e.g. a NAS) doesn't hold back the others and a disk isn't written by several threads at once.
+    Each target of an operation with mirrors goes to the thread of its own device.
+    The amount of bytes being transferred at the same time is bounded,
+    a single operation is always allowed to run even if it's bigger than the bound.
+    undo() withdraws an operation that hasn't started yet, or queues its reversal behind it
+    """
+
+    max_inflight_bytes: int
+    failures: list[tuple[FileOperation,Exception]]
+    """Operations that raised an error, with the error itself"""
+
+    def __init__(self,
+            max_inflight_bytes: int = 512 * 1024**2,
+            on_done: Callable[[FileOperation,Exception | None],None] | None = None,
+            timer: StageTimer = DISABLED,
+            verify: bool = False) -> None:
+        """
+        on_done is called from the worker threads after each operation (once all its targets are written),
+        with its error if it failed. With verify, copies are read back and compared to the source
+        """
+        self.max_inflight_bytes = max_inflight_bytes
+        self.verify = verify
+        self.timer = timer
+        self.on_done = on_done
+        self.failures = []
+        self._queues: dict[int | str,queue.Queue] = {} # by device
+        self._devices: dict[str,int | str] = {} # destination directory -> device
+        self._workers: list[threading.Thread] = []
+        self._cond = threading.Condition()
+        self._inflight_bytes = 0
+        self._inflight_count = 0
+        self._pending = 0
+        self._pending_destinations: dict[str,int] = {} # destination path -> number of queued writes
+        self._waiting: set[int] = set() # ids of the queued operations that have not started
+        self._withdrawn: set[int] = set()
+        self._fan_outs: dict[int,FanOut] = {} # id of the operation -> its fan-out, until it's over
+
+    @property
+    def pending(self) -> int:
+        """Number of operations submitted and not finished yet"""
+        return self._pending
+
+    def is_pending_destination(self, destination:str) -> bool:
+        """True if a queued operation is going to create the file at destination"""
+        with self._cond:
+            return destination in self._pending_destinations
+
+    def _queue(self, destination:str) -> queue.Queue:
+        """Queue of the device destination is on, called holding the lock"""
+        dest_dir = os.path.dirname(os.path.abspath(destination))
+        device = self._devices.get(dest_dir)
+        if device is None:
+            try:
+                device = os.stat(dest_dir).st_dev
+            except OSError:
+                device = dest_dir # the operation will fail anyway, on a queue of its own
+            self._devices[dest_dir] = device
+        if device not in self._queues:
+            q = queue.Queue()
+            worker = threading.Thread(target=self._work,args=(q,),daemon=True,name=f"visieve-fileops-{dest_dir}")
+            self._queues[device] = q
+            self._workers.append(worker)
+            worker.start()
+        return self._queues[device]
+
+    def submit(self, op: FileOperation, after: FanOut | None = None):
+        """Queue op, never blocks. Its targets don't start before the fan-out after is over"""
+        if not op.size:
+            try:
+                op.size = os.path.getsize(op.source)
+            except OSError:
+                op.size = 0
+        fan_out = FanOut(op,self.verify,after) if op.mirrors or self.verify else None
+        with self._cond:
+            if fan_out is not None: self._fan_outs[id(op)] = fan_out
+            self._pending += 1
+            for target in op.targets():
+                self._pending_destinations[target.destination] = self._pending_destinations.get(target.destination,0) + 1
+            self._waiting.add(id(op))
+            queues = [ (self._queue(target.destination),target) for target in op.targets() ]
+        for q,target in queues: q.put((target,fan_out))
+
+    def _work(self, q: queue.Queue):
+        while True:
+            item = q.get()
+            if item is None: return
+            target,fan_out = item
+            op = target if fan_out is None else fan_out.op
+            with self._cond:
+                self._waiting.discard(id(op))
+                if id(op) in self._withdrawn:
+                    # already accounted for by undo(), once every target is skipped
+                    if fan_out is None or fan_out.skip():
+                        self._withdrawn.discard(id(op))
+                        self._fan_outs.pop(id(op),None)
+                    continue
+
+            # the targets of a reversal on other devices may still be writing what it undoes.
+            # That fan-out was queued earlier everywhere, so it never waits for this one
+            if fan_out is not None and fan_out.after is not None: fan_out.after.finished.wait()
+
+            # wait for enough bandwidth to be available
+            with self._cond:
+                while self._inflight_count and self._inflight_bytes + op.size > self.max_inflight_bytes:
+                    self._cond.wait()
+                self._inflight_bytes += op.size
+                self._inflight_count += 1
+
+            error = None
+            try:
+                with self.timer.stage("file_op"):
+                    if fan_out is None: transfer(target)
+                    else: fan_out.write(target)
+            except Exception as e:
+                error = e
+                self._failed(target,e)
+            finally:
+                done = True
+                if fan_out is not None:
+                    # the last target written completes the operation
+                    done = fan_out.finish(error)
+                    if done and fan_out.error is None:
+                        try:
+                            fan_out.complete()
+                        except Exception as e:
+                            self._failed(op,e)
+                    error = fan_out.error
+                    if done:
+                        with self._cond: self._fan_outs.pop(id(op),None)
+                        fan_out.finished.set()
+                if done and self.on_done is not None:
+                    try:
+                        self.on_done(op,error)
+                    except Exception as e:
+                        # the operation is over either way, the worker has to go on or drain() never returns
+                        print(f"Could not record the {op.mode.value} of {op.source}: {e}")
+                with self._cond:
+                    self._inflight_bytes -= op.size
+                    self._inflight_count -= 1
+                    self._finish(target,done)
+
+    def _failed(self, op: FileOperation, error: Exception):
+        action = f"undo the {op.mode.value} of" if op.undo else op.mode.value
+        print(f"Could not {action} {op.source} into {op.destination}: {error}")
+        self.failures.append((op,error))
+
+    def _finish(self, target: FileOperation, done:bool = True):
+        """
+        Bookkeeping of a finished (or withdrawn) target, called holding the lock.
+        done is False for the targets of an operation that still has others being written
+        """
+        if done: self._pending -= 1
+        left = self._pending_destinations[target.destination] - 1
+        if left: self._pending_destinations[target.destination] = left
+        else: del self._pending_destinations[target.destination]
+        self._cond.notify_all()
+
+    def undo(self, op: FileOperation):
+        """
+        Cancel op if it's still waiting in its queue, otherwise queue its reversal:
+        every target of both goes through the queue of its device, so the reversal always runs after op.
+        The reversal of a fan-out also waits for all of its targets, which run on other devices
+        """
+        with self._cond:
+            if id(op) in self._waiting:
+                self._waiting.discard(id(op))
+                self._withdrawn.add(id(op))
+                for target in op.targets(): self._finish(target,target is op)
+                return
+            after = self._fan_outs.get(id(op))
+        self.submit(op.reversed(),after)
+
+    def drain(self, timeout: float | None = None) -> bool:
+        """Wait until every submitted operation is done, returns False on timeout"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._pending == 0,timeout)
+
+    def close(self):
+        """Finish every pending operation and stop the worker threads"""
+        self.drain()
+        for q in self._queues.values(): q.put(None)
+        for worker in self._workers: worker.join()
+        self._queues.clear()
+        self._workers.clear()
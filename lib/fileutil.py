@@ -1,37 +1,51 @@
 from PIL import Image
+from functools import cache
+import importlib
 import os
-from os import path
-from pathlib import Path
 
-IMAGE_EXTENSIONS = { ex for ex,f in Image.registered_extensions().items() }
+PLUGIN_EXTENSIONS = {
+    ".jpg": "JpegImagePlugin", ".jpeg": "JpegImagePlugin", ".jpe": "JpegImagePlugin", ".jfif": "JpegImagePlugin",
+    ".png": "PngImagePlugin", ".apng": "PngImagePlugin", ".gif": "GifImagePlugin",
+    ".bmp": "BmpImagePlugin", ".dib": "BmpImagePlugin", ".tif": "TiffImagePlugin", ".tiff": "TiffImagePlugin",
+    ".webp": "WebPImagePlugin", ".avif": "AvifImagePlugin", ".avifs": "AvifImagePlugin", ".mpo": "MpoImagePlugin",
+    ".pbm": "PpmImagePlugin", ".pgm": "PpmImagePlugin", ".ppm": "PpmImagePlugin", ".pnm": "PpmImagePlugin", ".pfm": "PpmImagePlugin",
+    ".jp2": "Jpeg2KImagePlugin", ".j2k": "Jpeg2KImagePlugin", ".jpc": "Jpeg2KImagePlugin", ".jpf": "Jpeg2KImagePlugin",
+    ".jpx": "Jpeg2KImagePlugin", ".j2c": "Jpeg2KImagePlugin", ".psd": "PsdImagePlugin", ".tga": "TgaImagePlugin",
+    ".icb": "TgaImagePlugin", ".vda": "TgaImagePlugin", ".vst": "TgaImagePlugin", ".ico": "IcoImagePlugin",
+    ".cur": "CurImagePlugin", ".icns": "IcnsImagePlugin", ".pcx": "PcxImagePlugin", ".dcx": "DcxImagePlugin",
+    ".dds": "DdsImagePlugin", ".ps": "EpsImagePlugin", ".eps": "EpsImagePlugin", ".fit": "FitsImagePlugin",
+    ".fits": "FitsImagePlugin", ".fli": "FliImagePlugin", ".flc": "FliImagePlugin", ".ftc": "FtexImagePlugin",
+    ".ftu": "FtexImagePlugin", ".gbr": "GbrImagePlugin", ".blp": "BlpImagePlugin", ".im": "ImImagePlugin",
+    ".iim": "IptcImagePlugin", ".mpg": "MpegImagePlugin", ".mpeg": "MpegImagePlugin", ".msp": "MspImagePlugin",
+    ".pcd": "PcdImagePlugin", ".pxr": "PixarImagePlugin", ".qoi": "QoiImagePlugin", ".bw": "SgiImagePlugin",
+    ".rgb": "SgiImagePlugin", ".rgba": "SgiImagePlugin", ".sgi": "SgiImagePlugin", ".ras": "SunImagePlugin",
+    ".wmf": "WmfImagePlugin", ".emf": "WmfImagePlugin", ".xbm": "XbmImagePlugin", ".xpm": "XpmImagePlugin",
+    ".bufr": "BufrStubImagePlugin", ".grib": "GribStubImagePlugin", ".h5": "Hdf5StubImagePlugin", ".hdf": "Hdf5StubImagePlugin",
+}
+"""
+Pillow plugin handling each extension. Loading every plugin (Image.registered_extensions) is a noticeable
+part of the startup, so only the plugin of an extension actually found in the source gets imported.
+Image.open finds it registered then, and doesn't load the others either
+"""
+VIDEO_EXTENSIONS = { ".mp4", ".m4v", ".mov", ".avi", ".mkv", ".webm", ".wmv", ".mts", ".m2ts", ".3gp", ".mpg", ".mpeg" }
 
+@cache
+def _load_plugin(name:str) -> bool:
+    try:
+        importlib.import_module(f"PIL.{name}")
+        return True
+    except ImportError:
+        return False # a plugin this version of Pillow doesn't have, or one missing its library
 def is_valid_image_file(filepath:str) -> bool:
+    """True if the extension (in any case) is one PIL can open"""
     _filename, fileextension = os.path.splitext(filepath)
-    return fileextension in IMAGE_EXTENSIONS
+    fileextension = fileextension.lower()
+    # registered already: preloaded, or by a plugin from another package (e.g. HEIF)
+    if fileextension in Image.EXTENSION: return True
+    plugin = PLUGIN_EXTENSIONS.get(fileextension)
+    return plugin is not None and _load_plugin(plugin) and fileextension in Image.EXTENSION
 
-def count_image_files(path:str) -> int:
-    """
-    Returns a count of all the files in the path folder that
-    can be opened by a PIL Image
-    """
-    counter = 0
-    for filepath in Path(os.fsdecode(path)).iterdir():
-        if is_valid_image_file(filepath): counter += 1
-    return counter
-    
-
-if __name__ == "__main__":
-    """ exts = Image.registered_extensions()
-    supported = { ex for ex,f in exts.items() }
-    print(supported) """
-    print(count_image_files("./example/dest1/"))
-
-def get_unique_filename(filename:str) -> str:
-    if not path.exists(filename): return filename
-    else:
-        prefix, suffix = os.path.splitext(filename)
-        counter = 1
-        while True:
-            newname = f"{prefix}({counter}){suffix}"
-            if not path.exists(newname): return newname
-            counter += 1
\ No newline at end of file
+def is_video_file(filepath:str) -> bool:
+    """True if the extension (in any case) is a video container"""
+    _filename, fileextension = os.path.splitext(filepath)
+    return fileextension.lower() in VIDEO_EXTENSIONS
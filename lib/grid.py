@@ -0,0 +1,169 @@
+from .datatypes import InstanceConfig
+from .sorter import SortingDialog
+from concurrent.futures import ThreadPoolExecutor
+from typing import Generator
+from PIL import Image, ImageDraw
+import tkinter as tk
+import os, sys
+
+GAP = 4
+"""Pixels between two tiles of a sheet"""
+SELECTED_COLOR = (255,200,0)
+SORTED_SHADE = 160
+"""Alpha of the dark veil over the tiles that are already sorted"""
+
+def compose_sheet(tiles:list[Image.Image], columns:int, cell:tuple[int,int]) -> Image.Image:
+    """Paste the tiles row by row into cells of the given size, each one centered in its cell"""
+    rows = max(1,-(-len(tiles) // columns))
+    sheet = Image.new("RGB",(columns*cell[0] + (columns-1)*GAP,rows*cell[1] + (rows-1)*GAP))
+    for i,tile in enumerate(tiles):
+        x,y = cell_origin(i,columns,cell)
+        sheet.paste(tile,(x + (cell[0]-tile.width)//2,y + (cell[1]-tile.height)//2))
+    return sheet
+
+def cell_origin(i:int, columns:int, cell:tuple[int,int]) -> tuple[int,int]:
+    """Top left corner of the i-th cell of a sheet"""
+    row,column = divmod(i,columns)
+    return (column*(cell[0]+GAP),row*(cell[1]+GAP))
+
+def cell_at(x:int, y:int, columns:int, cell:tuple[int,int]) -> int | None:
+    """Index of the cell containing the sheet coordinates x,y, None for the gaps and outside"""
+    column,dx = divmod(x,cell[0]+GAP)
+    row,dy = divmod(y,cell[1]+GAP)
+    if x < 0 or y < 0 or column >= columns or dx >= cell[0] or dy >= cell[1]: return None
+    return row*columns + column
+
+class GridSortingDialog(SortingDialog):
+    """
+    Sorting window showing a contact sheet of previews, one page at a time.
+    Tiles get selected with the mouse, a bound key sorts the selected ones
+    (or every tile left, if nothing is selected). Once every tile is sorted the next page comes up.
+    Pages go through the same prefetcher as single images, so the next sheet is already composed
+    when it's needed, and the tiles of a page are decoded in parallel
+    """
+
+    zoomable = False
+    undoable = False
+
+    def __init__(self, config:InstanceConfig) -> None:
+        self.columns,self.rows = config.grid
+        self.cell = (
+            max(1,(config.size[0] - (self.columns-1)*GAP) // self.columns),
+            max(1,(config.size[1] - (self.rows-1)*GAP) // self.rows)
+        )
+        self.page: list[list[str]] = [] # the groups on screen, one per tile
+        self.sheet = None # composed page without the selection marks
+        self.selected: set[int] = set()
+        self.sorted: dict[int,str] = {} # tile -> key it was sorted with
+        self._tile_pool = ThreadPoolExecutor(max_workers=min(8,os.cpu_count() or 1),thread_name_prefix="visieve-tile")
+        super().__init__(config)
+
+    def _create_bindings(self):
+        super()._create_bindings()
+        self.lab_img.bind("<Button-1>",self._toggle_tile)
+        self.window.bind("<Escape>",lambda _e: self._set_selection(set()))
+        self.window.bind("<Control-a>",lambda _e: self._set_selection(set(range(len(self.page))) - self.sorted.keys()))
+
+    def groups_iterator(self) -> Generator[list[list[str]],None,None]:
+        """
+        Generator of the pages: lists of up to columns x rows groups.
+        A watched source that caught up gets its partial page right away, instead of once it fills up
+        """
+        page = []
+        for group in super().groups_iterator(idle=True):
+            if group is None:
+                if page: yield page
+                page = []
+                continue
+            page.append(group)
+            if len(page) == self.columns * self.rows:
+                yield page
+                page = []
+        if page: yield page
+
+    def load_group(self, page:list[list[str]]) -> Image.Image:
+        """A page is represented by the sheet of the previews of its groups"""
+        tiles = list(self._tile_pool.map(self._load_tile,page))
+        return compose_sheet(tiles,self.columns,self.cell)
+
+    def _load_tile(self, group:list[str]) -> Image.Image:
+        try:
+            tile = self.load_image(group[0],self.cell).copy()
+        except Exception as e:
+            print(f"Could not open {group[0]}: {e}")
+            tile = Image.new("RGB",(self.cell[0],self.cell[1] // 2),(64,0,0))
+        tile.thumbnail(self.cell)
+        if len(group) > 1:
+            ImageDraw.Draw(tile).text((4,4),f"{len(group)} similar",fill=(255,255,255))
+        return tile
+
+    def _show_next_image(self):
+        """Display the next prefetched page, or check again later if it isn't composed yet"""
+        try:
+            item = self.prefetcher.next_ready()
+        except StopIteration:
+            print("Reached end of file set")
+            self._close_pipeline()
+            sys.exit()
+        if item is None:
+            self.window.after(50,self._show_next_image)
+            return
+        self.page,self.sheet = item
+        self.selected = set()
+        self.sorted = {}
+        self._render(stage="photoimage")
+        self.current_group = [ path for group in self.page for path in group ]
+        self.current_img_path = self.current_group[0]
+
+    def _render(self,stage:str = "redraw"):
+        """Show the sheet with the sorted tiles darkened and the selected ones outlined"""
+        sheet = self.sheet.convert("RGBA")
+        marks = Image.new("RGBA",sheet.size)
+        draw = ImageDraw.Draw(marks)
+        for i in range(len(self.page)):
+            x,y = cell_origin(i,self.columns,self.cell)
+            box = (x,y,x+self.cell[0]-1,y+self.cell[1]-1)
+            if i in self.sorted:
+                draw.rectangle(box,fill=(0,0,0,SORTED_SHADE))
+                draw.text((x+6,y+6),self.sorted[i],fill=(255,255,255,255))
+            elif i in self.selected:
+                draw.rectangle(box,outline=SELECTED_COLOR,width=GAP)
+        self._display(Image.alpha_composite(sheet,marks).convert("RGB"),text="",stage=stage)
+
+    def _set_selection(self, selected:set[int]):
+        if self.current_img_path is None: return
+        self.selected = selected
+        self._render()
+
+    def _toggle_tile(self, event:tk.Event):
+        if self.current_img_path is None: return
+        # the label centers the image, event coordinates are relative to the label
+        img = self.lab_img.image
+        x = event.x - (self.lab_img.winfo_width() - img.width()) // 2
+        y = event.y - (self.lab_img.winfo_height() - img.height()) // 2
+        i = cell_at(x,y,self.columns,self.cell)
+        if i is None or i >= len(self.page) or i in self.sorted: return
+        self._set_selection(self.selected ^ {i})
+
+    def handle_keypress(self, event:tk.Event):
+        """Sort the selected tiles (or all of those left) into the directory bound to the key"""
+        if self.current_img_path is None: return
+        key = event.keysym
+        if key not in self.config.dest: raise ValueError("Error: key bound but not in destination config")
+        tiles = self.selected or set(range(len(self.page))) - self.sorted.keys()
+        for i in sorted(tiles):
+            for path in self.page[i]: self.sieve_file(path,key)
+            self._count_sorted(len(self.page[i]))
+            self.sorted[i] = key
+        self.selected = set()
+
+        if len(self.sorted) == len(self.page):
+            self.current_group = [] # already counted tile by tile
+            self.update_image()
+        else:
+            self._update_progress()
+            self._render()
+
+    def _close_pipeline(self):
+        super()._close_pipeline()
+        self._tile_pool.shutdown(wait=False,cancel_futures=True)
@@ -0,0 +1,207 @@
+from .sqlitecache import SQLiteCache
+from collections import deque
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+from typing import Generator, Iterable
+import hashlib
+import os
+from os import path
+import threading
+
+PARTIAL_BYTES = 64 * 1024
+"""How much of the beginning of a file the partial hash covers"""
+CHUNK_BYTES = 1024**2
+LOOKAHEAD = 32
+"""How many upcoming source files get their partial hash computed in advance"""
+
+def _digest(filepath:str, limit:int | None = None) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    with open(filepath,"rb") as f:
+        if limit is not None:
+            h.update(f.read(limit))
+        else:
+            while chunk := f.read(CHUNK_BYTES): h.update(chunk)
+    return h.hexdigest()
+
+class HashCache:
+    """Persistent partial/full content hashes, None as the location keeps them in memory only"""
+
+    def __init__(self, location: str | None = None) -> None:
+        self._store = SQLiteCache(location,"hashes",["partial TEXT","full TEXT"])
+
+    @staticmethod
+    def _key(filepath:str) -> tuple[str,int,int]:
+        stat = os.stat(filepath)
+        return (path.abspath(filepath),stat.st_mtime_ns,stat.st_size)
+
+    def _get(self, key:tuple, column:str) -> str | None:
+        row = self._store.get(key,column)
+        return row[0] if row else None
+
+    def _set(self, key:tuple, column:str, value:str):
+        self._store.set(key,column,value)
+
+    def partial(self, filepath:str) -> str:
+        """Hash of the first PARTIAL_BYTES of the file"""
+        key = self._key(filepath)
+        value = self._get(key,"partial")
+        if value is None:
+            value = _digest(filepath,PARTIAL_BYTES)
+            self._set(key,"partial",value)
+        return value
+
+    def full(self, filepath:str) -> str:
+        """Hash of the whole file"""
+        key = self._key(filepath)
+        if key[2] <= PARTIAL_BYTES: return self.partial(filepath) # already covers everything
+        value = self._get(key,"full")
+        if value is None:
+            value = _digest(filepath)
+            self._set(key,"full",value)
+        return value
+
+    def close(self):
+        self._store.close()
+
+
+class ContentIndex:
+    """
+    Finds byte-identical files among the destinations and the source files seen so far.
+    Candidates are narrowed down by size first, then by partial hash, and only files
+    that agree on both get fully hashed. Destinations are listed on a background thread
+    and the upcoming source files are pre-hashed on a thread pool
+    """
+
+    skipped: int
+    """Number of source files that turned out to be duplicates"""
+
+    def __init__(self, destinations: Iterable[str], cache: HashCache, workers:int = 4) -> None:
+        self.cache = cache
+        self.skipped = 0
+        self._unhashed: dict[int,list[str]] = {} # by size, files nothing of the same size was compared with yet
+        self._by_partial: dict[tuple[int,str],list[str]] = {} # by (size, partial hash)
+        self._where: dict[str,tuple[int,str | None]] = {} # path -> (size, partial hash) of its bucket
+        self._sizes: set[int] = set() # sizes of every candidate
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers,thread_name_prefix="visieve-hash")
+        self._listed = threading.Thread(target=self._list_destinations,args=(list(destinations),),daemon=True)
+        self._listed.start()
+
+    def _list_destinations(self, destinations:list[str]):
+        for directory in destinations:
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_file(): self.add(entry.path,entry.stat().st_size)
+            except OSError as e:
+                print(f"Could not scan {directory}: {e}")
+
+    def add(self, filepath:str, size:int):
+        """Make filepath a candidate for future comparisons, it's only read once a file of the same size shows up"""
+        with self._lock:
+            self._unhashed.setdefault(size,[]).append(filepath)
+            self._where[filepath] = (size,None)
+            self._sizes.add(size)
+
+    def replace(self, old:str, new:str):
+        """The file at old is being moved to new (e.g. by a MOVE operation)"""
+        with self._lock:
+            key = self._where.pop(old,None)
+            if key is None: return
+            candidates = self._unhashed[key[0]] if key[1] is None else self._by_partial[key]
+            candidates[candidates.index(old)] = new
+            self._where[new] = key
+
+    def _hash_size(self, size:int):
+        """Move the candidates of that size into the buckets of their partial hash"""
+        with self._lock:
+            unhashed = list(self._unhashed.get(size,()))
+        if not unhashed: return
+        partials = {}
+        for filepath in unhashed:
+            try:
+                partials[filepath] = self.cache.partial(filepath)
+            except OSError:
+                partials[filepath] = None # vanished or unreadable, never a match
+        with self._lock:
+            left = []
+            for filepath in self._unhashed.pop(size,()):
+                if filepath not in partials:
+                    left.append(filepath) # renamed or added meanwhile
+                    continue
+                partial = partials[filepath]
+                if partial is None:
+                    self._where.pop(filepath,None)
+                    continue
+                self._by_partial.setdefault((size,partial),[]).append(filepath)
+                self._where[filepath] = (size,partial)
+            if left: self._unhashed[size] = left
+
+    def find_duplicate(self, filepath:str, size:int) -> str | None:
+        """
+        Returns a known file identical to filepath, or None.
+        Only the candidates with the same size and partial hash get fully hashed
+        """
+        self._hash_size(size)
+        try:
+            partial = self.cache.partial(filepath)
+        except OSError:
+            return None # vanished or unreadable, can't be sure
+        with self._lock:
+            candidates = [ c for c in self._by_partial.get((size,partial),()) if path.abspath(c) != path.abspath(filepath) ]
+        for candidate in candidates:
+            try:
+                if self.cache.full(candidate) == self.cache.full(filepath): return candidate
+            except OSError:
+                continue
+        return None
+
+    def _prehash(self, filepath:str, size:int):
+        # files with a unique size can't be duplicates, don't even read them
+        with self._lock:
+            if size not in self._sizes: return
+        self._hash_size(size)
+        try:
+            self.cache.partial(filepath)
+        except OSError:
+            pass
+
+    def unique_paths(self, entries: Iterable[tuple[str,int] | None]) -> Generator[str | None,None,None]:
+        """
+        Yields the paths of the (path, size) entries that don't duplicate a destination file
+        or an earlier entry. Meant to run off the Tk thread (e.g. inside the prefetcher).
+        A None entry (a live source caught up, see SourceIndex.iter_indices) releases every entry
+        held in the look-ahead, and is passed on
+        """
+        self._listed.join()
+        window = deque()
+        def emit(filepath, size, future):
+            try:
+                future.result()
+            except CancelledError:
+                return False # closing down
+            duplicate = self.find_duplicate(filepath,size)
+            if duplicate is not None:
+                self.skipped += 1
+                print(f"Skipping {filepath}, identical to {duplicate}")
+                return False
+            self.add(filepath,size)
+            return True
+
+        for entry in entries:
+            if entry is None:
+                while window:
+                    item = window.popleft()
+                    if emit(*item): yield item[0]
+                yield None
+                continue
+            filepath,size = entry
+            window.append((filepath,size,self._pool.submit(self._prehash,filepath,size)))
+            if len(window) > LOOKAHEAD:
+                item = window.popleft()
+                if emit(*item): yield item[0]
+        while window:
+            item = window.popleft()
+            if emit(*item): yield item[0]
+
+    def close(self):
+        self._pool.shutdown(wait=False,cancel_futures=True)
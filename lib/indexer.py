@@ -0,0 +1,244 @@
+from .datatypes import SortOrder
+from .fileutil import is_valid_image_file, is_video_file
+from .timing import StageTimer, DISABLED
+from .exif import CaptureTimeCache
+from array import array
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Generator, Iterable
+import os
+from os import path
+import re
+import threading
+
+_DIGITS = re.compile(r"(\d+)")
+
+def natural_key(filepath:str) -> tuple:
+    """Sort key that compares the runs of digits in a path by value"""
+    parts = _DIGITS.split(filepath.lower())
+    parts[1::2] = map(int,parts[1::2])
+    return tuple(parts)
+
+class SourceIndex:
+    """
+    Index of the images in a source directory, built with a single os.scandir pass
+    on a background thread. Every entry keeps its path, modification time and size
+    in parallel arrays, entries are numbered in the order they were found.
+    In recursive mode every subdirectory is scanned as a separate task on a thread pool,
+    except the exclude directories (destinations within the source, whose files are sorted already).
+    With videos, video files are indexed alongside the images.
+    While live (see SourceWatcher) entries keep being added after the scan,
+    and the iterators wait for them instead of ending.
+    With a CaptureTimeCache, the capture time of every entry is read from its header on a thread pool
+    as soon as the scan finds it, so that ordering by it is ready about as soon as the scan is done
+    """
+
+    paths: list[str]
+    mtimes: array
+    """Modification times (float seconds), same indices as paths"""
+    sizes: array
+    """File sizes in bytes, same indices as paths"""
+
+    def __init__(self,
+            source:str,
+            recursive:bool = False,
+            workers:int = 8,
+            timer:StageTimer = DISABLED,
+            videos:bool = False,
+            capture_times:CaptureTimeCache | None = None,
+            exclude: Iterable[str] = ()) -> None:
+        self.source = os.fsdecode(source)
+        self.videos = videos
+        self.timer = timer
+        self.recursive = recursive
+        self.exclude = { path.normcase(path.abspath(d)) for d in exclude }
+        self.paths = []
+        self.mtimes = array("d")
+        self.sizes = array("q")
+        self.done = False
+        self.scanned = 0 # entries found by the scan itself, set once it is done
+        self.live = False
+        self._cond = threading.Condition()
+        self.capture_times = capture_times
+        self._captured: list[Future] = [] # capture time of every entry, same indices as paths
+        if capture_times is not None:
+            self._exif_pool = ThreadPoolExecutor(max_workers=workers,thread_name_prefix="visieve-exif")
+
+        if recursive:
+            self._pool = ThreadPoolExecutor(max_workers=workers,thread_name_prefix="visieve-scan")
+            self._outstanding = 0 # directories submitted and not scanned yet
+            self._submit_dir(self.source)
+        else:
+            self._pool = None
+            threading.Thread(target=self._scan_single,daemon=True).start()
+
+    @property
+    def count(self) -> int:
+        """Number of images found so far"""
+        return len(self.paths)
+
+    def _add(self, batch:list[tuple[str,float,int]]):
+        """Append a batch of (path, mtime, size) entries and wake up whoever is waiting for them"""
+        if not batch: return
+        with self._cond:
+            for p,mtime,size in batch:
+                self.paths.append(p)
+                self.mtimes.append(mtime)
+                self.sizes.append(size)
+                if self.capture_times is not None:
+                    self._captured.append(self._exif_pool.submit(self.capture_times.capture_time,p,mtime,size))
+            self._cond.notify_all()
+
+    def add_file(self, filepath:str, mtime:float, size:int):
+        """Append a file found after the scan"""
+        self._add([(filepath,mtime,size)])
+
+    def set_live(self, live:bool):
+        """While live, the iterators wait for more entries once they reach the end"""
+        with self._cond:
+            self.live = live
+            self._cond.notify_all()
+
+    def _finish(self):
+        with self._cond:
+            self.done = True
+            self.scanned = len(self.paths)
+            self._cond.notify_all()
+        if self._pool is not None: self._pool.shutdown(wait=False)
+
+    def accepts(self, name:str) -> bool:
+        """True if a file called name belongs in the index"""
+        return is_valid_image_file(name) or (self.videos and is_video_file(name))
+
+    def _scan_dir(self, directory:str, batch_size:int = 256) -> list[str]:
+        """Index the images in directory, returns its subdirectories"""
+        with self.timer.stage("scan"):
+            return self._scan_entries(directory,batch_size)
+
+    def _scan_entries(self, directory:str, batch_size:int) -> list[str]:
+        subdirs = []
+        batch = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if not entry.name.startswith(".") and path.normcase(path.abspath(entry.path)) not in self.exclude:
+                                subdirs.append(entry.path)
+                            continue
+                        # filter on the name first, so that only media files cost a stat
+                        if not self.accepts(entry.name) or not entry.is_file(): continue
+                        stat = entry.stat()
+                    except OSError:
+                        continue # vanished or unreadable entry
+                    batch.append((entry.path,stat.st_mtime,stat.st_size))
+                    if len(batch) >= batch_size:
+                        self._add(batch)
+                        batch = []
+        except OSError as e:
+            print(f"Could not scan {directory}: {e}")
+        self._add(batch)
+        return subdirs
+
+    def _scan_single(self):
+        try:
+            self._scan_dir(self.source)
+        finally:
+            self._finish()
+
+    def _submit_dir(self, directory:str):
+        with self._cond:
+            self._outstanding += 1
+        self._pool.submit(self._scan_recursive,directory)
+
+    def _scan_recursive(self, directory:str):
+        try:
+            for subdir in self._scan_dir(directory):
+                self._submit_dir(subdir)
+        finally:
+            with self._cond:
+                self._outstanding -= 1
+                last = self._outstanding == 0
+            if last: self._finish()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """Block until the scan is complete, returns False on timeout"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.done,timeout)
+
+    def wait_for_any(self) -> bool:
+        """Block until at least one image is found (True) or the scan ends without any (False)"""
+        with self._cond:
+            self._cond.wait_for(lambda: self.paths or self.done)
+            return bool(self.paths)
+
+    def capture_time(self, i:int) -> float:
+        """Capture time of entry i, its modification time if it has none. Waits for the header to be read"""
+        captured = None
+        if self.capture_times is not None:
+            try:
+                captured = self._captured[i].result()
+            except Exception:
+                pass
+        return captured if captured is not None else self.mtimes[i]
+
+    def ordered_indices(self, order:SortOrder) -> list[int]:
+        """Indices of the entries found by the scan in the given order, only meaningful once it is done"""
+        match order:
+            case SortOrder.NEWEST_FIRST:
+                return sorted(range(self.scanned),key=self.mtimes.__getitem__,reverse=True)
+            case SortOrder.SCAN:
+                return list(range(self.scanned))
+            case SortOrder.CAPTURE_TIME:
+                return sorted(range(self.scanned),key=self.capture_time)
+            case SortOrder.NAME:
+                return sorted(range(self.scanned),key=lambda i: natural_key(self.paths[i]))
+            case SortOrder.LARGEST_FIRST:
+                return sorted(range(self.scanned),key=self.sizes.__getitem__,reverse=True)
+            case _:
+                raise ValueError(f"Sort order {order} is not supported")
+
+    def _tail(self, i:int, follow:bool, idle:bool = False) -> Generator[int | None,None,None]:
+        """
+        Yields the indices from i on as entries get added, until the index stops growing.
+        With idle, None is yielded every time the scan is over and every entry is consumed,
+        before waiting for the next one to be added
+        """
+        def available() -> int:
+            return len(self.paths) if follow or not self.done else self.scanned
+        def ended() -> bool:
+            return self.done and not (follow and self.live)
+        while True:
+            with self._cond:
+                caught_up = self.done and i >= available() and not ended()
+            if idle and caught_up: yield None
+            with self._cond:
+                self._cond.wait_for(lambda: i < available() or ended())
+                if i >= available(): return
+            yield i
+            i += 1
+
+    def iter_indices(self, order:SortOrder, follow:bool = True, idle:bool = False) -> Generator[int | None,None,None]:
+        """
+        Yields the indices of the entries in the requested order.
+        In SCAN order entries are yielded as soon as they are found,
+        the other orders wait for the scan to complete.
+        Entries added after the scan come last, in arrival order, unless follow is False.
+        With idle, None marks every point where the live index caught up and waits for new files
+        """
+        if order is SortOrder.SCAN:
+            yield from self._tail(0,follow,idle)
+        else:
+            self.wait()
+            yield from self.ordered_indices(order)
+            if follow: yield from self._tail(self.scanned,True,idle)
+
+    def iter_added(self, idle:bool = False) -> Generator[int | None,None,None]:
+        """Yields the indices of the entries added after the scan, as they arrive (idle as in iter_indices)"""
+        self.wait()
+        yield from self._tail(self.scanned,True,idle)
+
+    def close(self):
+        """Stop reading capture times that nobody is going to need"""
+        if self.capture_times is not None:
+            self._exif_pool.shutdown(wait=False,cancel_futures=True)
+            self.capture_times.close()
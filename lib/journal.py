@@ -0,0 +1,160 @@
+from .datatypes import InstanceConfig, SieveMode
+from .fileops import FileOperation
+import hashlib
+import json
+import os
+from os import path
+import queue
+import threading
+import time
+
+def journal_path(config: InstanceConfig, directory:str, operator: str | None = None) -> str:
+    """
+    Journal file of a session. Sessions with the same source, destinations and sieve mode
+    share it, so restarting with the same settings resumes where the last run stopped.
+    Operators sharing a source each get their own: operator is the name this one claims files under
+    """
+    identity = json.dumps([
+        path.abspath(config.source),
+        sorted((k,path.abspath(d) if isinstance(d,str) else [ path.abspath(p) for p in d ]) for k,d in config.dest.items()),
+        config.sieve_mode.value,
+    ] + ([operator] if operator is not None else []))
+    return path.join(directory,hashlib.sha1(identity.encode()).hexdigest()[:16] + ".jsonl")
+
+def read_records(filepath:str) -> list[dict]:
+    """Every intact record of the journal, a torn last line (crash mid-write) is ignored"""
+    records = []
+    if not path.exists(filepath): return records
+    with open(filepath,"rb") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+class Journal:
+    """
+    Append-only log of the decisions taken in a sorting session.
+    Every decision is a "decide" record (source, key, destination folder, final name or None if
+    the duplicate policy dropped it, mode), followed by a "done" record once the file operation finished,
+    or by an "undo" record if the user took the decision back.
+    Records are written by a background thread that fsyncs whatever accumulated since the last fsync,
+    so logging never waits for the disk
+    """
+
+    decided: dict[str,dict]
+    """Last decide record of every source file, by absolute path"""
+    completed: set[str]
+    """Source files whose operation is known to be finished"""
+
+    def __init__(self, filepath:str, fresh:bool = False) -> None:
+        """fresh discards whatever earlier sessions recorded in the journal"""
+        self.path = filepath
+        os.makedirs(path.dirname(path.abspath(filepath)),exist_ok=True)
+        if fresh and path.exists(filepath): os.remove(filepath)
+        self.decided = {}
+        self.completed = set()
+        for record in read_records(filepath): self._apply(record)
+
+        self._queue: queue.Queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop,daemon=True,name="visieve-journal")
+        self._writer.start()
+
+    def _apply(self, record:dict):
+        source = record.get("source")
+        match record.get("op"):
+            case "decide":
+                self.decided[source] = record
+                if record.get("final") is None: self.completed.add(source) # nothing to do for it
+                else: self.completed.discard(source)
+            case "done":
+                if record.get("ok"): self.completed.add(source)
+            case "undo":
+                self.decided.pop(source,None)
+                self.completed.discard(source)
+
+    def is_decided(self, source:str) -> bool:
+        return path.abspath(source) in self.decided
+
+    def decide(self, source:str, key:str, dest_dir: str | list[str], op: FileOperation | None, mode: SieveMode):
+        """Record the decision taken for source (op is None if the file was not to be copied)"""
+        record = {
+            "op":"decide", "source":path.abspath(source), "key":key, "dest":dest_dir,
+            "final": op.destination if op is not None else None, "mode":mode.value, "time":time.time()
+        }
+        if op is not None and op.mirrors: record["mirrors"] = [ m.destination for m in op.mirrors ]
+        self._log(record)
+
+    def done(self, op: FileOperation, error: Exception | None = None):
+        """Record the outcome of a file operation (can be called from any thread)"""
+        if op.undo: return # undo() already took the decision back
+        self._log({"op":"done", "source":path.abspath(op.source), "ok": error is None})
+
+    def undo(self, source:str):
+        """Record that the decision taken for source was taken back"""
+        self._log({"op":"undo", "source":path.abspath(source), "time":time.time()})
+
+    def _log(self, record:dict):
+        self._apply(record)
+        self._queue.put(json.dumps(record) + "\n")
+
+    def _write_loop(self):
+        with open(self.path,"a",encoding="utf-8") as f:
+            while True:
+                # group commit: everything queued while the last fsync ran goes in the next one
+                lines = [self._queue.get()]
+                while True:
+                    try:
+                        lines.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                stop = None in lines
+                f.writelines(l for l in lines if l is not None)
+                f.flush()
+                os.fsync(f.fileno())
+                if stop: return
+
+    def unfinished(self) -> list[FileOperation]:
+        """
+        Operations that were decided but never reported as done (e.g. the program died with
+        them still queued) and can still be carried out: the source is still there
+        """
+        ops = []
+        for source,record in self.decided.items():
+            if source in self.completed or not path.exists(source): continue
+            mirrors = [ FileOperation(source,m,SieveMode.COPY) for m in record.get("mirrors",[]) ]
+            ops.append(FileOperation(source,record["final"],SieveMode(record["mode"]),mirrors=mirrors))
+        return ops
+
+    def close(self):
+        """Flush every pending record and stop the writer thread"""
+        self._queue.put(None)
+        self._writer.join()
+
+def compact(filepath:str):
+    """
+    Rewrite a (closed) journal keeping one decide record per source that was not undone,
+    plus its done record if the operation finished
+    """
+    decided = {}
+    completed = set()
+    for record in read_records(filepath):
+        source = record.get("source")
+        if record.get("op") == "decide":
+            decided[source] = record
+            completed.discard(source)
+        elif record.get("op") == "done" and record.get("ok"):
+            completed.add(source)
+        elif record.get("op") == "undo":
+            decided.pop(source,None)
+            completed.discard(source)
+
+    tmp = filepath + ".tmp"
+    with open(tmp,"w",encoding="utf-8") as f:
+        for source,record in decided.items():
+            f.write(json.dumps(record) + "\n")
+            if source in completed: f.write(json.dumps({"op":"done","source":source,"ok":True}) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp,filepath)
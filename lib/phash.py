@@ -0,0 +1,212 @@
+# Perceptual hashes and near-duplicate clustering, used to group burst shots.
+# Needs NumPy, so this module is only imported when burst grouping is enabled
+from .preview import load_preview
+from .datatypes import PreviewQuality
+from .fileutil import is_video_file
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Generator, Iterable
+from PIL import Image
+import numpy as np
+import os
+
+ANALYSIS_WIDTH = 64
+"""Width of the previews the hashes are computed from, JPEG draft makes them very cheap"""
+BLOCK_PAIRS = 1 << 22
+"""Most hash pairs compared at once, so that a big bucket is compared a block of rows at a time"""
+
+def ahash(image:Image.Image) -> int:
+    """Average hash: 8x8 grayscale thumbnail, one bit per pixel brighter than the mean"""
+    pixels = np.asarray(image.convert("L").resize((8,8),Image.BILINEAR),dtype=np.float32)
+    return _pack(pixels > pixels.mean())
+
+def dhash(image:Image.Image) -> int:
+    """Difference hash: one bit per horizontally adjacent pixel pair of a 9x8 thumbnail"""
+    pixels = np.asarray(image.convert("L").resize((9,8),Image.BILINEAR),dtype=np.int16)
+    return _pack(pixels[:,1:] > pixels[:,:-1])
+
+def _dct_matrix(n:int) -> np.ndarray:
+    k = np.arange(n)
+    m = np.cos(np.pi * (2*k[None,:] + 1) * k[:,None] / (2*n))
+    m[0] /= np.sqrt(2)
+    return m * np.sqrt(2/n)
+
+_DCT32 = _dct_matrix(32)
+
+def phash(image:Image.Image) -> int:
+    """DCT hash: low frequencies of a 32x32 thumbnail compared against their median"""
+    pixels = np.asarray(image.convert("L").resize((32,32),Image.BILINEAR),dtype=np.float64)
+    low = (_DCT32 @ pixels @ _DCT32.T)[:8,:8]
+    return _pack(low > np.median(low))
+
+def _pack(bits:np.ndarray) -> int:
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(),"big")
+
+HASHES: dict[str,Callable[[Image.Image],int]] = {
+    "ahash": ahash,
+    "dhash": dhash,
+    "phash": phash,
+}
+
+# popcount of every byte value, NumPy < 2 has no bitwise_count
+_POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)],dtype=np.uint8)
+
+def hamming(a:np.ndarray, b:np.ndarray) -> np.ndarray:
+    """Elementwise Hamming distance between two (broadcastable) uint64 arrays"""
+    x = np.bitwise_xor(a,b)
+    if hasattr(np,"bitwise_count"): return np.bitwise_count(x)
+    return _POPCOUNT8[x[...,None].view(np.uint8)].sum(axis=-1)
+
+def _buckets(hashes:np.ndarray, threshold:int) -> Generator[np.ndarray,None,None]:
+    """
+    Yields groups of indices that hold every pair of hashes at most threshold bits apart.
+    Multi-index search: the 64 bits are split into threshold+1 chunks, and by pigeonhole
+    two close hashes agree exactly on at least one of them, so only hashes sharing
+    a chunk value need to be compared, instead of all n^2 pairs
+    """
+    if not 0 <= threshold < 64: raise ValueError(f"Invalid threshold {threshold}")
+    bounds = np.linspace(0,64,threshold+2).astype(int)
+    for start,end in zip(bounds[:-1],bounds[1:]):
+        mask = np.uint64((1 << int(end - start)) - 1)
+        keys = (hashes >> np.uint64(start)) & mask
+        order = np.argsort(keys,kind="stable")
+        # boundaries of the runs of equal chunk values
+        cuts = np.flatnonzero(np.diff(keys[order])) + 1
+        for bucket in np.split(order,cuts):
+            if len(bucket) > 1: yield bucket
+
+def cluster(hashes:np.ndarray, threshold:int) -> list[int]:
+    """
+    Label of the cluster of each hash: the index of its first member.
+    Identical hashes (a long burst) are collapsed first, then the close pairs of each bucket are listed
+    a block of rows at a time, its connected parts are found with vectorised min-label propagation
+    over those pairs, and joined across buckets with a union-find
+    """
+    hashes = np.asarray(hashes,dtype=np.uint64)
+    if len(hashes) == 0: return []
+    unique,first,inverse = np.unique(hashes,return_index=True,return_inverse=True)
+    parent = list(range(len(unique)))
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for bucket in _buckets(unique,threshold):
+        values = unique[bucket]
+        rows = max(1,BLOCK_PAIRS // len(bucket))
+        pairs = [ np.nonzero(hamming(values[i:i+rows,None],values[None,:]) <= threshold) for i in range(0,len(bucket),rows) ]
+        near_i = np.concatenate([ p[0] + i*rows for i,p in enumerate(pairs) ])
+        near_j = np.concatenate([ p[1] for p in pairs ])
+        # position (in the bucket) of the smallest member reachable from each one
+        labels = np.arange(len(bucket))
+        while True:
+            spread = labels.copy()
+            np.minimum.at(spread,near_i,labels[near_j])
+            spread = spread[spread] # pointer jumping, so long chains take few rounds
+            if np.array_equal(spread,labels): break
+            labels = spread
+        moved = labels != np.arange(len(bucket))
+        for i,label in zip(bucket[moved],bucket[labels[moved]]):
+            ri,rl = find(int(i)),find(int(label))
+            if ri != rl: parent[max(ri,rl)] = min(ri,rl)
+
+    roots = np.array([find(i) for i in range(len(unique))])
+    cluster_first = np.full(len(unique),len(hashes))
+    np.minimum.at(cluster_first,roots,first)
+    return cluster_first[roots[inverse.ravel()]].tolist()
+
+class BurstGrouper:
+    """
+    Analysis stage that hashes every image of a stream on a thread pool,
+    clusters near-identical ones and gives them back as groups,
+    each group at the position of its first member.
+    Bursts are contiguous runs of the stream, so an image only joins a group with a member
+    at most horizon images earlier, and groups go out as soon as the stream is past them
+    """
+
+    analysed: int
+    """Number of images hashed so far"""
+
+    def __init__(self, threshold:int = 6, method:str = "dhash", workers:int | None = None) -> None:
+        if method not in HASHES: raise ValueError(f"Unknown hash method {method}")
+        self.threshold = threshold
+        self.hash_function = HASHES[method]
+        self.analysed = 0
+        self._pool = ThreadPoolExecutor(max_workers=workers or min(8,os.cpu_count() or 1),thread_name_prefix="visieve-phash")
+
+    def _hash(self, filepath:str) -> int | None:
+        if is_video_file(filepath):
+            self.analysed += 1
+            return None # videos are never grouped
+        try:
+            return self.hash_function(load_preview(filepath,ANALYSIS_WIDTH,PreviewQuality.FAST))
+        except Exception as e:
+            print(f"Could not analyse {filepath}: {e}")
+            return None
+        finally:
+            self.analysed += 1
+
+    def groups(self, paths:Iterable[str], window:int = 256, horizon:int = 256) -> Generator[list[str],None,None]:
+        """Yields the paths grouped by visual similarity, in order of first appearance"""
+        ordered: list[str] = []
+        values: list[int | None] = []
+        parent: list[int] = [] # union-find over the positions, the root of a group is its first member
+        members: dict[int,list[int]] = {}
+        pending = deque()
+        clustered = 0 # positions up to here are clustered with everything before them
+        given = 0 # positions up to here are given out
+
+        def find(i:int) -> int:
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        def collect():
+            filepath,future = pending.popleft()
+            i = len(ordered)
+            ordered.append(filepath)
+            values.append(future.result())
+            parent.append(i)
+            members[i] = [i]
+
+        def cluster_tail():
+            nonlocal clustered
+            start = max(0,clustered - horizon)
+            # unreadable files stay on their own
+            hashed = [ i for i in range(start,len(ordered)) if values[i] is not None ]
+            if hashed:
+                labels = cluster(np.array([values[i] for i in hashed],dtype=np.uint64),self.threshold)
+                for i,label in zip(hashed,labels):
+                    a,b = find(i),find(hashed[label])
+                    if a == b: continue
+                    a,b = min(a,b),max(a,b)
+                    parent[b] = a
+                    members[a] += members.pop(b)
+            clustered = len(ordered)
+
+        def complete(final:bool) -> Generator[list[str],None,None]:
+            # in order of first member, up to the first group that may still grow
+            nonlocal given
+            while given < clustered:
+                if find(given) == given:
+                    group = sorted(members[given])
+                    if not final and group[-1] >= clustered - horizon: return
+                    del members[given]
+                    yield [ ordered[i] for i in group ]
+                given += 1
+
+        for filepath in paths:
+            pending.append((filepath,self._pool.submit(self._hash,filepath)))
+            if len(pending) >= window:
+                collect()
+                if len(ordered) - clustered >= window:
+                    cluster_tail()
+                    yield from complete(False)
+        while pending: collect()
+        cluster_tail()
+        yield from complete(True)
+
+    def close(self):
+        self._pool.shutdown(wait=False,cancel_futures=True)
@@ -0,0 +1,110 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Iterable
+from PIL import Image
+from .preview import PreviewPyramid
+import os
+import threading
+
+def image_bytes(image) -> int:
+    """Rough estimate of the memory held by a decoded image, or by anything with an nbytes attribute"""
+    if not isinstance(image,Image.Image): return image.nbytes
+    return image.width * image.height * len(image.getbands())
+
+class Prefetcher:
+    """
+    Bounded look-ahead queue that decodes the upcoming groups of images on worker threads,
+    in the same order as the groups it is given (a grid page counts as one group of groups).
+    The consumer (the Tk thread) only polls for finished previews and never blocks on decoding
+    """
+
+    depth: int
+    """Maximum number of images queued or being decoded"""
+    memory_budget: int
+    """Maximum amount of bytes held by decoded images waiting to be shown"""
+
+    def __init__(self,
+            groups: Iterable[list],
+            loader: Callable[[list],PreviewPyramid | Image.Image],
+            depth: int = 4,
+            memory_budget: int = 256 * 1024**2,
+            workers: int | None = None) -> None:
+        self.loader = loader
+        self.depth = max(1,depth)
+        self.memory_budget = memory_budget
+        if workers is None: workers = min(4,os.cpu_count() or 1)
+
+        self._pending: deque[tuple[list,Future]] = deque()
+        self._cond = threading.Condition()
+        self._exhausted = False # the group iterable has no more items, or failed
+        self._closed = False
+        self._pool = ThreadPoolExecutor(max_workers=workers,thread_name_prefix="visieve-decode")
+
+        # the feeder runs on its own thread because iterating the groups may itself be slow
+        self._feeder = threading.Thread(target=self._feed,args=(groups,),daemon=True)
+        self._feeder.start()
+
+    def _queued_bytes(self) -> int:
+        """Memory used by the images that are already decoded but not yet consumed"""
+        total = 0
+        for _,future in self._pending:
+            if future.done() and future.exception() is None:
+                total += image_bytes(future.result())
+        return total
+
+    def _has_room(self) -> bool:
+        if len(self._pending) >= self.depth: return False
+        # always allow at least one image, even if it's bigger than the whole budget
+        return not self._pending or self._queued_bytes() < self.memory_budget
+
+    def _feed(self, groups: Iterable[list]):
+        """Submit groups to the decoding pool as long as the look-ahead has room for them"""
+        try:
+            for group in groups:
+                with self._cond:
+                    while not self._closed and not self._has_room():
+                        self._cond.wait()
+                    if self._closed: return
+                    future = self._pool.submit(self.loader,group)
+                    future.add_done_callback(self._notify)
+                    self._pending.append((group,future))
+        except Exception as e:
+            # e.g. the source or the lease files became unreadable: end the session with what's queued
+            print(f"Could not list the next images: {e!r}")
+        finally:
+            with self._cond:
+                self._exhausted = True
+                self._cond.notify_all()
+
+    def _notify(self, _future=None):
+        with self._cond:
+            self._cond.notify_all()
+
+    def next_ready(self) -> tuple[list,PreviewPyramid | Image.Image] | None:
+        """
+        Pop the next decoded group if it's ready, returns None if it's still being worked on.
+        Raises StopIteration once every group has been consumed
+        """
+        while True:
+            with self._cond:
+                if not self._pending:
+                    if self._exhausted: raise StopIteration
+                    return None
+                group,future = self._pending[0]
+                if not future.done(): return None
+                self._pending.popleft()
+                self._cond.notify_all() # the feeder may have room again
+
+            try:
+                return group,future.result()
+            except Exception as e:
+                # a broken file shouldn't end the session, just skip it
+                print(f"Could not open {group}: {e}")
+
+    def close(self):
+        """Stop the feeder and drop every image that has not been consumed yet"""
+        with self._cond:
+            self._closed = True
+            self._pending.clear()
+            self._cond.notify_all()
+        self._pool.shutdown(wait=False,cancel_futures=True)
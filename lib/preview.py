@@ -0,0 +1,153 @@
+from .datatypes import PreviewQuality
+from .timing import StageTimer, DISABLED
+from PIL import Image, ExifTags
+import io
+import threading
+
+# JPEG thumbnail location tags inside IFD1 of the EXIF block
+THUMBNAIL_OFFSET_TAG = 0x0201
+THUMBNAIL_LENGTH_TAG = 0x0202
+
+RESAMPLING = {
+    PreviewQuality.FAST: Image.BILINEAR,
+    PreviewQuality.EXACT: Image.BICUBIC,
+}
+MAX_PIXELS = 256 * 1024**2
+"""
+Most pixels decoded at once (768 MiB as RGB). Headers of any size are opened, a gigapixel JPEG
+is only ever decoded scaled down (draft) or a region at a time, but PNG and compressed TIFF get fully
+decoded, on several prefetch workers at once, so a corrupt or hostile file must still be refused
+"""
+_open_lock = threading.Lock()
+
+REDUCING_GAP = {
+    # reduce() as far as possible, the final filter only covers the last <2x step
+    PreviewQuality.FAST: 1.0,
+    # keep 3x headroom above the target size, visually identical to a full resize
+    PreviewQuality.EXACT: 3.0,
+}
+
+def open_image(filepath:str) -> Image.Image:
+    """
+    Image.open without Pillow's decompression bomb check, which refuses to even read the header
+    of a big image. What actually gets decoded is checked with check_decode instead
+    """
+    with _open_lock:
+        limit = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = None
+        try:
+            return Image.open(filepath)
+        finally:
+            Image.MAX_IMAGE_PIXELS = limit
+
+def check_decode(size:tuple[int,int]):
+    """Raises DecompressionBombError if decoding an image of that size needs more than MAX_PIXELS"""
+    if size[0] * size[1] > MAX_PIXELS:
+        raise Image.DecompressionBombError(f"Decoding {size[0]}x{size[1]} pixels exceeds the limit of {MAX_PIXELS}")
+
+def fit_width(size:tuple[int,int], width:int) -> tuple[int,int]:
+    """Scale size so that it is width pixels wide, keeping the aspect ratio"""
+    (a,b) = size
+    return (width,max(1,int(b*width/a)))
+
+def _exif_thumbnail(image_file:Image.Image, target:tuple[int,int]) -> Image.Image | None:
+    """
+    Returns the thumbnail embedded in the EXIF data if it is at least as big as target
+    and has the same aspect ratio as the full image, None otherwise
+    """
+    raw = image_file.info.get("exif")
+    ifd1 = getattr(getattr(ExifTags,"IFD",None),"IFD1",None) # only in recent Pillow versions
+    if not raw or ifd1 is None: return None
+    try:
+        thumb_info = image_file.getexif().get_ifd(ifd1)
+        offset = thumb_info.get(THUMBNAIL_OFFSET_TAG)
+        length = thumb_info.get(THUMBNAIL_LENGTH_TAG)
+        if not offset or not length: return None
+        # offsets are relative to the TIFF header, which follows the "Exif\0\0" marker
+        start = 6 + offset if raw.startswith(b"Exif") else offset
+        thumb = Image.open(io.BytesIO(raw[start:start+length]))
+        check_decode(thumb.size)
+        thumb.load()
+    except Exception:
+        # broken or unusual EXIF blocks are common, just decode the real image
+        return None
+
+    (a,b) = image_file.size
+    (c,d) = thumb.size
+    if c < target[0] or d < target[1]: return None
+    if abs(a/b - c/d) > 0.01: return None # letterboxed thumbnails would look wrong
+    return thumb
+
+def fit_box(size:tuple[int,int], box:tuple[int,int]) -> tuple[int,int]:
+    """Scale size so that it fits inside box, keeping the aspect ratio"""
+    (a,b) = size
+    scale = min(box[0]/a,box[1]/b)
+    return (max(1,round(a*scale)),max(1,round(b*scale)))
+
+def load_preview(
+        path:str,
+        width:int,
+        quality:PreviewQuality = PreviewQuality.EXACT,
+        timer:StageTimer = DISABLED,
+        height:int | None = None) -> Image.Image:
+    """
+    Open the file at path and return a copy that is width pixels wide (or fits inside width x height).
+    Decodes at the smallest scale the codec supports (JPEG DCT scaling via draft,
+    or the embedded EXIF thumbnail in FAST mode) and shrinks the rest with reduce()
+    before the final filter, so large photos never get fully decoded
+    """
+    with timer.stage("open"):
+        image_file = open_image(path)
+    with image_file:
+        new_size = fit_width(image_file.size,width) if height is None else fit_box(image_file.size,(width,height))
+
+        if quality is PreviewQuality.FAST:
+            thumb = _exif_thumbnail(image_file,new_size)
+            if thumb is not None:
+                return thumb.resize(new_size,RESAMPLING[quality])
+
+        # only does something for formats that support scaled decoding (JPEG), must precede load()
+        with timer.stage("decode"):
+            image_file.draft(image_file.mode,new_size)
+            check_decode(image_file.size)
+            image_file.load()
+        with timer.stage("resize"):
+            return image_file.resize(
+                new_size,
+                RESAMPLING[quality],
+                reducing_gap=REDUCING_GAP[quality]
+            )
+
+class PreviewPyramid:
+    """
+    A decoded preview plus copies halved down to min_width, kept for the image on screen
+    and those in the look-ahead, so that a resized window re-renders from the nearest level
+    instead of decoding the file again
+    """
+
+    levels: list[Image.Image]
+    """Biggest first"""
+
+    def __init__(self, image:Image.Image, min_width:int = 160) -> None:
+        self.levels = [image]
+        while self.levels[-1].width // 2 >= min_width:
+            self.levels.append(self.levels[-1].reduce(2))
+
+    @property
+    def size(self) -> tuple[int,int]:
+        return self.levels[0].size
+
+    @property
+    def nbytes(self) -> int:
+        """Rough estimate of the memory held by every level"""
+        return sum(l.width * l.height * len(l.getbands()) for l in self.levels)
+
+    def render(self, box:tuple[int,int], quality:PreviewQuality = PreviewQuality.EXACT) -> Image.Image:
+        """The image scaled to fit box, resized from the smallest level that is still big enough"""
+        target = fit_box(self.size,box)
+        level = self.levels[0]
+        for candidate in self.levels:
+            if candidate.width < target[0]: break
+            level = candidate
+        if level.size == target: return level
+        return level.resize(target,RESAMPLING[quality])
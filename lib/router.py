@@ -0,0 +1,91 @@
+from .datatypes import InstanceConfig, SieveMode, DuplicateMode
+from .destindex import DestinationIndex
+from .fileops import FileOperation, TRASH_DIR
+from .timing import StageTimer, DISABLED
+import ntpath
+import os
+import time
+
+class Router:
+    """
+    Decides where a source file ends up, applying the SieveMode and DuplicateMode of a config.
+    Shared by the sorting window and the batch mode, so that both behave the same way.
+    With keep_overwritten, files replaced because of DuplicateMode.OVERWRITE are set aside
+    in the TRASH_DIR of their destination instead of being lost, so that the operation can be undone
+    """
+
+    def __init__(self,
+            config: InstanceConfig,
+            dest_index: DestinationIndex | None = None,
+            timer:StageTimer = DISABLED,
+            keep_overwritten:bool = False) -> None:
+        self.config = config
+        self.timer = timer
+        self.keep_overwritten = keep_overwritten
+        self.dest_index = dest_index if dest_index is not None else DestinationIndex()
+
+    def route(self, path:str, dest: str | list[str]) -> FileOperation | None:
+        """
+        Returns the operation that sorts the file at path into dest,
+        or None if the duplicate policy says the file is not to be copied (or it is in dest already).
+        dest can be several folders (fan-out): the file goes into the first one the duplicate policy
+        lets it into, the others get copies of it (the mirrors of the operation).
+        The chosen names are reserved right away, the operation still has to be carried out
+        """
+        targets = [ self._route(path,d) for d in ([dest] if isinstance(dest,str) else dest) ]
+        targets = [ t for t in targets if t is not None ]
+        if not targets: return None
+        op,op.mirrors = targets[0],targets[1:]
+        for mirror in op.mirrors: mirror.mode = SieveMode.COPY
+        return op
+
+    def _route(self, path:str, dest_dir:str) -> FileOperation | None:
+        """The operation that sorts the file at path into a single folder"""
+        if dest_dir[-1] != "/": dest_dir+="/" # just to be sure to be able to concatenate
+        filename = ntpath.basename(path)
+        dest_name = dest_dir + filename
+        if os.path.normcase(os.path.abspath(path)) == os.path.normcase(os.path.abspath(dest_name)):
+            # the file is in that folder already: overwriting it would set it aside as its own backup
+            print(f"{path} is already in {dest_dir}, leaving it there")
+            return None
+
+        # check if file with same name already exists (or is about to) at destination
+        # if so, handle collision according to self.duplicate_mode
+        backup = None
+        with self.timer.stage("name_conflict"):
+            if self.dest_index.exists(dest_name):
+                dest_name = self.solve_name_conflict(dest_name)
+                if self.keep_overwritten and dest_name is not None and self.dest_index.exists(dest_name):
+                    backup = f"{dest_dir}{TRASH_DIR}/{time.time_ns()}-{filename}"
+        if dest_name is None: return None
+
+        if self.config.sieve_mode not in (SieveMode.COPY,SieveMode.MOVE):
+            raise ValueError(f"Sieve mode {self.config.sieve_mode} is not supported")
+        self.dest_index.add(dest_name)
+        return FileOperation(path,dest_name,self.config.sieve_mode,backup=backup)
+
+    def solve_name_conflict(self,destination:str) -> str | None:
+        """
+        To be called if the file at path destination exists to solve the collision.
+        Will handle the existing file according to self.config and will return the final filename
+        (or None if the file is not to be copied)
+        """
+        match self.config.duplicate_mode:
+            case DuplicateMode.MAINTAIN:
+                # the already existing file has precedence, do not copy
+                return None
+            case DuplicateMode.OVERWRITE:
+                # the existing file gets replaced by the operation, use its name
+                return destination
+            case DuplicateMode.ASSIGN_UNIQUE_NAME:
+                # preserve the old file, enumerate the new one until you get a unique name
+                return self.dest_index.unique_name(destination)
+            case DuplicateMode.HALT:
+                # deliberarely crash the program
+                raise ValueError("Error! File already exists and DuplicateMode is HALT")
+            case DuplicateMode.SKIP_IDENTICAL:
+                # identical files never get here, so this is a different file with the same name
+                return self.dest_index.unique_name(destination)
+            case _:
+                # catch-all for invalid mode
+                raise ValueError(f"Error! Invalid DuplicateMode: {self.config.duplicate_mode=}")
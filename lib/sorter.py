@@ -1,35 +1,101 @@
-from typing import Generator
-from .datatypes import InstanceConfig, SieveMode, DuplicateMode
-from .fileutil import count_image_files, is_valid_image_file, get_unique_filename
+from typing import Generator, Iterable
+from .datatypes import InstanceConfig, SieveMode, DuplicateMode, SortOrder
+from .indexer import SourceIndex
+from .exif import CaptureTimeCache
+from .claims import Claims
+from .destindex import DestinationIndex
+from .hashing import ContentIndex, HashCache
+from .prefetch import Prefetcher
+from .preview import PreviewPyramid, load_preview
+from .fileutil import is_video_file
+from .video import VideoPlayer, video_preview, videos_supported
+from .thumbcache import ThumbnailCache
+from .fileops import FileOpQueue, FileOperation, discard_backup
+from .router import Router
+from .journal import Journal, compact, journal_path
+from .watcher import SourceWatcher
+from .timing import StageTimer
+from .undo import Decision, PreviewLRU, UndoLog
+from .zoom import ZoomView
+from concurrent.futures import Future, ThreadPoolExecutor
 import tkinter as tk
 from tkinter import messagebox
 from tkinter import ttk
-import PIL
 from PIL import Image, ImageTk
 import os, sys
-import shutil
-from pathlib import Path
-import ntpath
+
+POLL_INTERVAL_MS = 10
+"""How often the Tk thread checks whether the next image has been decoded"""
+STATUS_INTERVAL_MS = 200
+"""How often the pending file operations counter gets refreshed"""
+RESIZE_DELAY_MS = 60
+"""The image is re-rendered once the window has stopped changing size for this long"""
+SIZE_STEP = 128
+"""Decoded previews fit a box rounded up to a multiple of this, so that the cache keeps hitting while resizing"""
+TEXT_HEIGHT = 24
+"""Room left to the text above the image"""
+ZOOM_STEP = 1.5
+PAN_STEP = 120
+"""Pixels the arrow keys move a zoomed image by"""
 
 class SortingDialog:
-    
+
+    zoomable = True
+    """Whether the image on screen can be zoomed into"""
+    undoable = True
+    """Whether keypresses can be taken back (if undo_depth allows it)"""
+
     def __init__(self,config: InstanceConfig) -> None:
         # config assignment and validation
         self.config = config
         validity = self.config.is_valid()
         if validity is not True: raise ValueError(validity)
-        if not self.config.are_destinations_empty():
-            messagebox.showwarning(
-                title="File warning",
-                message="One or more destination directories are not empty. \
-                        Those files may be overwritten during execution"
-                )
+        # per-stage timings, when disabled every measurement is a no-op
+        self.timer = StageTimer(enabled=self.config.timing or self.config.timing_export is not None)
+
+        # destination listings are loaded once and kept up to date as files get sorted
+        self.dest_index = DestinationIndex()
+        # overwritten files are set aside as long as the operation can still be undone
+        undo = self.undoable and self.config.undo_depth > 0
+        self.router = Router(self.config,self.dest_index,self.timer,keep_overwritten=undo)
+        # listing big destinations takes a while, the warning comes up once the window is there
+        self._startup = ThreadPoolExecutor(max_workers=1,thread_name_prefix="visieve-startup")
+        self._destinations_checked = self._startup.submit(self.config.are_destinations_empty,self.dest_index)
 
-        # counter and max assignment
-        self.total_image_count = count_image_files(self.config.source)
-        if self.total_image_count <= 0:
-            print("No images found! Quitting")
-            sys.exit()
+        # index the source in the background, the total grows while the scan runs
+        videos = self.config.videos and videos_supported()
+        if self.config.videos and not videos: print("OpenCV is not installed, videos will be left out")
+        # capture times are read from the headers while scanning, and kept next to the preview cache
+        capture_times = None
+        if self.config.order is SortOrder.CAPTURE_TIME:
+            exif_location = None
+            if self.config.cache_dir is not None: exif_location = os.path.join(self.config.cache_dir,"exif.sqlite")
+            capture_times = CaptureTimeCache(exif_location)
+        self.index = SourceIndex(
+            self.config.source,
+            self.config.recursive,
+            timer=self.timer,
+            videos=videos,
+            capture_times=capture_times,
+            exclude=self.config.destination_dirs()
+        )
+        # with other operators on the same source, a file is only shown once this one holds its lease
+        self.claims = None
+        if self.config.shared:
+            self.claims = Claims(self.config.source,self.config.lease_seconds,self.config.operator)
+            print(f"Sharing {self.config.source} as {self.claims.operator}")
+        # in watch mode the source keeps growing, and an empty one is fine.
+        # Otherwise the window opens right away anyway, the first image shows up as soon as it's found
+        self.watcher = None
+        if self.config.watch:
+            self.watcher = SourceWatcher(
+                self.index,
+                exclude=self.config.destination_dirs(),
+                interval=self.config.watch_interval,
+                settle=self.config.watch_settle,
+                polling=self.config.watch_polling
+            )
+            print(f"Watching {self.config.source} for new files ({self.watcher.mode})")
         self.counter = 0 # counts how many images have been processed
 
         # base window configuration
@@ -40,118 +106,504 @@ class SortingDialog:
         self.window.columnconfigure(0,weight=2,minsize=self.config.size[0]*2/3) # image col
         self.window.columnconfigure(1,weight=1,minsize=self.config.size[0]/3) # legend col
 
-        # set up image object generator to iterate through the media
-        self.img_generator = self.images_iterator()
+        # previews decoded in earlier sessions are reused from disk
+        self.cache = None
+        if self.config.cache_dir is not None:
+            self.cache = ThumbnailCache(self.config.cache_dir,self.config.cache_budget)
+
+        # content based duplicate detection, hashes are kept next to the preview cache
+        self.content = None
+        if self.config.duplicate_mode is DuplicateMode.SKIP_IDENTICAL:
+            hash_location = None
+            if self.config.cache_dir is not None:
+                hash_location = os.path.join(self.config.cache_dir,"hashes.sqlite")
+            self.content = ContentIndex(self.config.destination_dirs(),HashCache(hash_location))
+
+        # near-identical shots are grouped after hashing the whole source (optional, needs NumPy)
+        self.grouper = None
+        if self.config.group_bursts:
+            from .phash import BurstGrouper
+            self.grouper = BurstGrouper(self.config.burst_threshold,self.config.burst_hash)
+
+        # every decision is journaled, so an interrupted session can resume where it stopped
+        self.journal = None
+        if self.config.journal_dir is not None:
+            # an unnamed operator is named after its process, so only a named one can resume its journal
+            operator = self.claims.operator if self.claims is not None else None
+            self.journal = Journal(journal_path(self.config,self.config.journal_dir,operator),fresh=not self.config.resume)
+            if self.journal.decided:
+                print(f"Resuming session: {len(self.journal.decided)} files already sorted")
+        self.resumed = 0 # source files left out because an earlier run already sorted them
+
+        # copies and moves happen in the background
+        self.fileops = FileOpQueue(
+            self.config.max_inflight_bytes,
+            on_done=self.journal.done if self.journal is not None else None,
+            timer=self.timer,
+            verify=self.config.verify_copies
+        )
+        if self.journal is not None:
+            # operations that were decided but still queued when the last session died
+            for op in self.journal.unfinished():
+                print(f"Finishing interrupted {op.mode.value} of {op.source}")
+                self.dest_index.add(op.destination)
+                self.fileops.submit(op)
+
+        # recent decisions can be taken back, their previews are kept to show them again right away
+        self.undo_log = UndoLog(self.config.undo_depth) if undo else None
+        self.recent = PreviewLRU(self.config.undo_memory)
+        self.returning = [] # (group, pyramid) put aside by undo, shown again before any new image
+        self.expired: list[FileOperation] = [] # operations that can't be undone anymore
+        self._undo_pool = None # decodes the previews the LRU no longer has
+
+        # start decoding the upcoming images in the background
+        self.current_img_path = None
+        self.finished = False # every image is sorted, the window stays open while that can be undone
+        self.current_group = [] # every file the next keypress applies to
+        self.player = None # plays the video on screen, if playback is on
+        self.view_box = self.config.size # room for the image, follows the size of the label
+        self.pyramid = None # levels of the image on screen
+        self.display = None # PhotoImage reused as long as the size stays the same
+        self.display_mode = None
+        self._resize_job = None
+        self.zoom = None # zoom and pan state, while zoomed in
+        self.tiles = PreviewLRU(self.config.zoom_memory) # decoded zoom tiles of every image
+        self._zoom_pool = None
+        self._drag = None
+        self.prefetcher = Prefetcher(
+            self.groups_iterator(),
+            self.load_group,
+            depth=self.config.prefetch_depth,
+            memory_budget=self.config.prefetch_memory
+        )
         
         # set up Label to house the image
         self.lab_img = tk.Label()
         self.lab_img.image = None
-        self.lab_img.grid(row=0,column=0)
+        self.lab_img.grid(row=0,column=0,sticky=tk.NSEW)
+        self.lab_img.bind("<Configure>",self._on_resize)
         # set up legend
         self._get_bindings_list().grid(row=0,column=1)
 
         # set up progress bar
         self.progress_bar = ttk.Progressbar(self.window,length=self.config.size[0])
-        self.progress_bar.grid(row=1,column=0,columnspan=2)
+        self.progress_bar.grid(row=1,column=0)
+        # set up pending file operations counter
+        self.lab_status = tk.Label(self.window)
+        self.lab_status.grid(row=1,column=1)
+        # set up the timings overlay, toggled with F2
+        self.lab_timing = tk.Label(self.window,justify=tk.LEFT,anchor=tk.NW,bg="black",fg="white")
+        self.timing_visible = False
+        if self.timer.enabled: self.window.bind("<F2>",self._toggle_timing)
+        self._update_status()
 
-        # create the bindings
-        for (k,_) in self.config.dest.items():
-            self.window.bind(k,self.handle_keypress)
+        self._create_bindings()
 
+        self.window.protocol("WM_DELETE_WINDOW",self._quit)
         self.window.eval("tk::PlaceWindow . center")
         self.update_image()
         self.window.mainloop()
 
+    def _create_bindings(self):
+        for (k,_) in self.config.dest.items():
+            self.window.bind(k,self.handle_keypress)
+        if self.undo_log is not None:
+            self.window.bind("<BackSpace>",self.undo)
+            self.window.bind("<Control-z>",self.undo)
+        self.window.bind("<Escape>",self._escape)
+        if self.zoomable:
+            for k in ("<plus>","<equal>","<KP_Add>"): self.window.bind(k,lambda _e: self._zoom(ZOOM_STEP))
+            for k in ("<minus>","<KP_Subtract>"): self.window.bind(k,lambda _e: self._zoom(1/ZOOM_STEP))
+            self.lab_img.bind("<MouseWheel>",lambda e: self._zoom(ZOOM_STEP if e.delta > 0 else 1/ZOOM_STEP,e))
+            self.lab_img.bind("<Button-4>",lambda e: self._zoom(ZOOM_STEP,e)) # X11 wheel
+            self.lab_img.bind("<Button-5>",lambda e: self._zoom(1/ZOOM_STEP,e))
+            for k,(dx,dy) in {"<Left>":(-1,0),"<Right>":(1,0),"<Up>":(0,-1),"<Down>":(0,1)}.items():
+                self.window.bind(k,lambda _e,dx=dx,dy=dy: self._pan(dx*PAN_STEP,dy*PAN_STEP))
+            self.lab_img.bind("<ButtonPress-1>",lambda e: setattr(self,"_drag",(e.x,e.y)))
+            self.lab_img.bind("<B1-Motion>",self._on_drag)
+
     def handle_keypress(self,event:tk.Event):
         """Function to be bound to the bound keys. Will move or copy the files as needed"""
+        # the next image is still being decoded, nothing is on screen to be sorted
+        if self.current_img_path is None: return
         key = event.keysym
         if key not in self.config.dest: raise ValueError("Error: key bound but not in destination config")
-        dest_dir = self.config.dest.get(key)
-        if dest_dir[-1] != "/": dest_dir+="/" # just to be sure to be able to concatenate
-        filename = ntpath.basename(self.current_img_path)
-        dest_name = dest_dir + filename
-
-        # check if file with same name already exists at destination
-        # if so, handle collision according to self.duplicate_mode
-        if os.path.exists(dest_name):
-            dest_name = self.solve_name_conflict(dest_name)
-
-        if dest_name is not None:
-            # copy or move depending on configuration
-            match self.config.sieve_mode:
-                case SieveMode.COPY:
-                    shutil.copy2(self.current_img_path,dest_name)
-                    print(f"Copying {self.current_img_path} into {dest_dir}")
-                case SieveMode.MOVE:
-                    shutil.copy2(self.current_img_path,dest_name)
-                    os.remove(self.current_img_path)
-                    print(f"Moving {self.current_img_path} into {dest_dir}")
-                case _:
-                    raise ValueError(f"Sieve mode {self.config.sieve_mode} is not supported")
+        decision = Decision(self.current_group,key)
+        for path in self.current_group:
+            op = self.sieve_file(path,key)
+            if op is not None: decision.ops.append(op)
 
+        if self.undo_log is not None:
+            if self.pyramid is not None: self.recent.put(self.current_img_path,self.pyramid)
+            dropped = self.undo_log.push(decision)
+            if dropped is not None: self.expired.extend(dropped.ops)
         self.update_image()
 
-    def solve_name_conflict(self,destination:str) -> str | None:
-        """
-        To be called if the file at path destination exists to solve the collision.
-        Will handle the existing file according to self.config and will return the final filename
-        (or None if the file is not to be copied)
-        """
-        match self.config.duplicate_mode:
-            case DuplicateMode.MAINTAIN:
-                # the already existing file has precedence, do not copy
+    def _escape(self,_event=None):
+        """Leave the zoom, or close the window once everything is sorted"""
+        if self.finished: self._quit()
+        else: self._leave_zoom()
+
+    def undo(self,_event=None):
+        """Take the last decision back and show its image again"""
+        if (self.current_img_path is None and not self.finished) or self.undo_log is None: return
+        decision = self.undo_log.pop()
+        if decision is None: return
+
+        for op in reversed(decision.ops):
+            # withdrawn if still queued, reversed after it otherwise
+            self.fileops.undo(op)
+            for target in op.targets():
+                if target.backup is None: self.dest_index.discard(target.destination)
+            if op.mode is SieveMode.MOVE and self.content is not None: self.content.replace(op.destination,op.source)
+        if self.journal is not None:
+            for path in decision.group: self.journal.undo(path)
+        if self.claims is not None:
+            for path in decision.group: self.claims.undo(path)
+        print(f"Undoing {decision.key} for {', '.join(decision.group)}")
+        self.counter -= len(decision.group)
+        self._update_progress()
+
+        # the image on screen comes back right after the undone one is sorted again
+        self._stop_video()
+        if not self.finished: self.returning.append((self.current_group,self.pyramid))
+        self.finished = False
+        self.current_img_path = None
+        moving_back = [ op.destination for op in decision.ops if op.mode is SieveMode.MOVE ]
+        self._show_when_undone(decision.group,self.recent.get(decision.group[0]),moving_back)
+
+    def _show_when_undone(self,group:list[str],preview:PreviewPyramid | Future | None,moving_back:list[str]):
+        """Show group once its moved files are back in the source and its preview is decoded"""
+        if any(self.fileops.is_pending_destination(d) for d in moving_back):
+            self.window.after(POLL_INTERVAL_MS,self._show_when_undone,group,preview,moving_back)
+            return
+        if preview is None:
+            # dropped from the LRU, decode it again
+            if self._undo_pool is None: self._undo_pool = ThreadPoolExecutor(max_workers=1,thread_name_prefix="visieve-undo")
+            preview = self._undo_pool.submit(self.load_group,group)
+        if isinstance(preview,Future):
+            if not preview.done():
+                self.window.after(POLL_INTERVAL_MS,self._show_when_undone,group,preview,[])
+                return
+            try:
+                preview = preview.result()
+            except Exception as e:
+                print(f"Could not open {group[0]}: {e}")
+                preview = PreviewPyramid(Image.new("RGB",self.view_box)) # it can still be sorted
+        self._show_item(group,preview)
+
+    def sieve_file(self,path:str,key:str) -> FileOperation | None:
+        """Queue the copy or move of a single file into the directory bound to key, returns the operation"""
+        if self.claims is not None:
+            if path in self.claims.lost:
+                print(f"Leaving {path} to the operator that took over its lease")
                 return None
-            case DuplicateMode.OVERWRITE:
-                # the existing file must be deleted, use its name
-                os.remove(destination)
-                return destination
-            case DuplicateMode.ASSIGN_UNIQUE_NAME:
-                # preserve the old file, enumerate the new one until you get a unique name
-                return get_unique_filename(destination)
-            case DuplicateMode.HALT:
-                # deliberarely crash the program
-                raise ValueError("Error! File already exists and DuplicateMode is HALT")
-            case _:
-                # catch-all for invalid mode
-                raise ValueError(f"Error! Invalid DuplicateMode: {self.config.duplicate_mode=}")
+            self.claims.done(path)
+        dest_dir = self.config.dest[key]
+        op = self.router.route(path,dest_dir)
+        if self.journal is not None: self.journal.decide(path,key,dest_dir,op,self.config.sieve_mode)
+        if op is None: return None
+
+        # copy or move depending on configuration, the actual work happens in the background
+        match op.mode:
+            case SieveMode.COPY:
+                print(f"Copying {path} into {' + '.join(self.config.targets(key))}")
+            case SieveMode.MOVE:
+                print(f"Moving {path} into {' + '.join(self.config.targets(key))}")
+                if self.content is not None: self.content.replace(path,op.destination)
+        self.fileops.submit(op)
+        return op
+
+    def _update_status(self):
+        """Refresh the pending file operations counter"""
+        self._update_progress()
+        if self._destinations_checked is not None and self._destinations_checked.done():
+            self._warn_destinations(self._destinations_checked)
+            self._destinations_checked = None
+        text = f"Pending: {self.fileops.pending}"
+        if self.watcher is not None and self.current_img_path is None:
+            text = "Waiting for new files... " + text
+        if self.grouper is not None and self.current_img_path is None:
+            text += f" Analysed: {self.grouper.analysed}"
+        if self.claims is not None and self.claims.skipped: text += f" Claimed by others: {self.claims.skipped}"
+        if self.fileops.failures: text += f" Failed: {len(self.fileops.failures)}"
+        self.lab_status.configure(text=text)
+        if self.timing_visible: self.lab_timing.configure(text=self.timer.overlay_text())
+        self.window.after(STATUS_INTERVAL_MS,self._update_status)
+
+    def _warn_destinations(self,checked:Future):
+        try:
+            empty = checked.result()
+        except OSError as e:
+            print(f"Could not list the destinations: {e}")
+            return
+        if not empty:
+            messagebox.showwarning(
+                title="File warning",
+                message="One or more destination directories are not empty. \
+                        Those files may be overwritten during execution"
+                )
+
+    def _toggle_timing(self,_event=None):
+        """Show or hide the timings overlay on top of the image"""
+        self.timing_visible = not self.timing_visible
+        if self.timing_visible:
+            self.lab_timing.configure(text=self.timer.overlay_text())
+            self.lab_timing.place(in_=self.lab_img,x=0,y=0)
+        else:
+            self.lab_timing.place_forget()
 
     def update_image(self):
         """Pass the next image in the generator to the label"""
 
-        # update the progress bar
-        self.progress_bar["value"] = self.counter/self.total_image_count * 100
-        self.counter += 1
+        self._update_progress()
+        self._count_sorted(len(self.current_group))
+
+        # keypresses are ignored until the next image is on screen
+        self.current_img_path = None
+        self._show_next_image()
+
+    def _count_sorted(self,images:int):
+        self.counter += images
+        self.timer.sorted(images)
 
-        # get the PhotoImage, path of the next file
+    def _update_progress(self):
+        """The total grows while the source is scanned or watched"""
+        total = self.index.count - self.resumed
+        if self.content is not None: total -= self.content.skipped
+        if self.claims is not None: total -= self.claims.skipped
+        self.progress_bar["value"] = self.counter/max(1,total) * 100
+
+    def _show_next_image(self):
+        """Display the next prefetched image, or check again later if it isn't decoded yet"""
+        if self.returning:
+            self._show_item(*self.returning.pop())
+            return
         try:
-            img,path= next(self.img_generator)
-        except StopIteration as s:
-            # a StopIteration gets thrown by a generator once it reaches the end
-            print("Reached end of file set")
-            sys.exit()
-
-        # assign the file to the label and memorize the path for the move/copy operation
-        self.lab_img.configure(image=img)
-        self.lab_img.image = img # Prevents the garbage collector from deleting the img object
-        self.current_img_path = path
-
-    def images_iterator(self) -> Generator[tuple[ImageTk.PhotoImage,str],None,None]:
+            item = self.prefetcher.next_ready()
+        except StopIteration:
+            # the prefetcher runs out once every path has been consumed
+            if self.index.count == 0: print("No images found! Quitting")
+            else: print("Reached end of file set")
+            if self.undo_log is None or len(self.undo_log) == 0:
+                self._close_pipeline()
+                sys.exit()
+            self._show_finished()
+            return
+        if item is None:
+            self.window.after(POLL_INTERVAL_MS,self._show_next_image)
+            return
+
+        self._show_item(*item)
+
+    def _show_finished(self):
+        """Keep the window open once the last image is sorted, so that decision can still be taken back"""
+        self._stop_video()
+        self.zoom = None
+        self.pyramid = None
+        self.current_group = []
+        self.finished = True
+        self._display(Image.new("RGB",self.view_box),text="All sorted. BackSpace takes the last decision back, Escape quits")
+
+    def _show_item(self,group:list[str],pyramid:PreviewPyramid):
+        """Put group on screen, ready to be sorted"""
+        # only fitting the pyramid to the label and the PhotoImage update happen on the Tk thread
+        self._stop_video()
+        self.zoom = None
+        self.pyramid = pyramid
+        with self.timer.stage("resize"):
+            image = pyramid.render(self.view_box,self.config.preview_quality)
+
+        # assign the file to the label and memorize the paths for the move/copy operation
+        group_text = f"{len(group)} similar images" if len(group) > 1 else ""
+        if is_video_file(group[0]): group_text = f"Video: {os.path.basename(group[0])}"
+        self._display(image,text=group_text)
+        self.current_group = group
+        self.current_img_path = group[0]
+
+        # the keyframes stay on screen until the player has decoded its first frame
+        if self.config.video_playback and is_video_file(group[0]):
+            self.player = VideoPlayer(group[0],self.view_box[0])
+            self.window.after(self.player.interval_ms,self._play_video,self.player)
+
+    def _play_video(self,player:VideoPlayer):
+        """Show the next frame decoded by player, until another file is on screen"""
+        if player is not self.player: return
+        frame = player.frame()
+        if frame is not None: self._display(frame,stage="video")
+        self.window.after(player.interval_ms,self._play_video,player)
+
+    def _display(self,image:Image.Image,text:str | None = None,stage:str = "photoimage"):
         """
-        Generator of pairs of PhotoImage and its corresponding path and order in directory
-        (sorted in chronological order, oldest first)
+        Show image in the label. The pixels are pasted into the current PhotoImage when the size
+        matches, a new one is only allocated when it changes. The time it takes goes to stage
         """
-        paths = sorted(Path(os.fsdecode(self.config.source)).iterdir(), key=os.path.getmtime, reverse=True)
-        for p in paths:
-            # skip this file if it's not an image
-            if not is_valid_image_file(p): continue
-
-            # open the file, resize it and return it as a PhotoImage
-            with Image.open(p) as image_file:
-                (a,b) = image_file.size
-                width = self.config.size[0]
-                new_size = (width,int(b*width/a))
-                resized_image = image_file.resize(new_size,PIL.Image.BICUBIC)
-            yield (ImageTk.PhotoImage(resized_image),p)
+        if image.mode not in ("RGB","RGBA"): image = image.convert("RGB")
+        with self.timer.stage(stage):
+            if self.display is not None and self.display.width() == image.width \
+                    and self.display.height() == image.height and self.display_mode == image.mode:
+                self.display.paste(image)
+            else:
+                self.display = ImageTk.PhotoImage(image)
+                self.display_mode = image.mode
+                self.lab_img.configure(image=self.display,compound=tk.TOP)
+                self.lab_img.image = self.display # Prevents the garbage collector from deleting the img object
+        if text is not None: self.lab_img.configure(text=text)
+
+    def _on_resize(self,event:tk.Event):
+        """Follow the size of the label, re-rendering once the user stops resizing"""
+        box = (max(1,event.width - 4),max(1,event.height - 4 - TEXT_HEIGHT))
+        if abs(box[0] - self.view_box[0]) < 8 and abs(box[1] - self.view_box[1]) < 8: return
+        self.view_box = box
+        if self._resize_job is not None: self.window.after_cancel(self._resize_job)
+        self._resize_job = self.window.after(RESIZE_DELAY_MS,self._rerender)
+
+    def _rerender(self):
+        self._resize_job = None
+        if self.pyramid is None or self.current_img_path is None: return
+        if self.zoom is not None: return self._render_zoom()
+        with self.timer.stage("resize"):
+            image = self.pyramid.render(self.view_box,self.config.preview_quality)
+        self._display(image,stage="redraw")
+
+    def _image_point(self,event:tk.Event) -> tuple[int,int]:
+        """Event coordinates relative to the image, which the label centers"""
+        return (
+            event.x - (self.lab_img.winfo_width() - self.display.width()) // 2,
+            event.y - (self.lab_img.winfo_height() - TEXT_HEIGHT - self.display.height()) // 2
+        )
+
+    def _zoom(self,factor:float,event:tk.Event | None = None):
+        """Zoom into the image on screen (factor > 1) or back out, around the pointer if event is given"""
+        if self.current_img_path is None or self.player is not None or is_video_file(self.current_img_path): return
+        if self.zoom is None:
+            if factor < 1: return
+            try:
+                if self._zoom_pool is None: self._zoom_pool = ThreadPoolExecutor(max_workers=2,thread_name_prefix="visieve-zoom")
+                self.zoom = ZoomView(self.current_img_path,self.pyramid,self.tiles,self._zoom_pool)
+            except Exception as e:
+                print(f"Cannot zoom into {self.current_img_path}: {e}")
+                return
+        anchor = self._image_point(event) if event is not None else None
+        self.zoom.zoom_by(factor,self.view_box,anchor)
+        if factor < 1 and self.zoom.zoom <= self.zoom.fit(self.view_box): return self._leave_zoom()
+        self._render_zoom()
+
+    def _pan(self,dx:float,dy:float):
+        if self.zoom is None: return
+        self.zoom.pan(dx,dy,self.view_box)
+        self._render_zoom()
+
+    def _on_drag(self,event:tk.Event):
+        if self.zoom is None or self._drag is None: return
+        (x,y) = self._drag
+        self._drag = (event.x,event.y)
+        self._pan(x - event.x,y - event.y)
+
+    def _render_zoom(self):
+        """Show the zoomed in region, with whatever tiles are decoded already"""
+        with self.timer.stage("zoom"):
+            image = self.zoom.render(self.view_box)
+        self._display(image,stage="redraw")
+        if self.zoom.waiting: self.window.after(POLL_INTERVAL_MS,self._poll_zoom,self.zoom)
+
+    def _poll_zoom(self,zoom:ZoomView):
+        """Redraw as soon as the tiles being decoded in the background arrive"""
+        if zoom is not self.zoom: return # zoomed out or moved on meanwhile
+        if zoom.collect(): self._render_zoom()
+        elif zoom.waiting: self.window.after(POLL_INTERVAL_MS,self._poll_zoom,zoom)
+
+    def _leave_zoom(self):
+        if self.zoom is None: return
+        self.zoom = None
+        self._rerender()
+
+    def decode_box(self) -> tuple[int,int]:
+        """Box previews get decoded to fit in: what the label currently has room for, at least the configured size"""
+        width,height = ( -(-max(c,v) // SIZE_STEP) * SIZE_STEP for c,v in zip(self.config.size,self.view_box) )
+        return (width,height)
+
+    def _stop_video(self):
+        if self.player is None: return
+        self.player.stop()
+        self.player = None
+
+    def images_iterator(self, indices: Iterable[int | None] | None = None) -> Generator[str | None,None,None]:
+        """
+        Generator of the paths of the images (and videos) in the source directory, in the configured order
+        (or of the given index entries). Files already sorted in an earlier run of the session are left out,
+        and so are duplicates when content based duplicate detection is on.
+        None is yielded whenever a watched source has caught up, see SourceIndex.iter_indices
+        """
+        if indices is None: indices = self.index.iter_indices(self.config.order,idle=True)
+        def entries():
+            for i in indices:
+                if i is None:
+                    yield None
+                    continue
+                path = self.index.paths[i]
+                if self.journal is not None and self.journal.is_decided(path):
+                    self.resumed += 1
+                    continue
+                yield path,self.index.sizes[i]
+        entries = entries()
+        if self.content is None: return (e if e is None else e[0] for e in entries)
+        return self.content.unique_paths(entries)
+
+    def groups_iterator(self, idle:bool = False) -> Generator[list[str] | None,None,None]:
+        """
+        Generator of the groups of files that get sorted with a single keypress.
+        When sharing the source, groups are claimed as they enter the look-ahead, so the leases
+        this operator holds are the prefetched groups and the one on screen.
+        With idle, None is yielded whenever a watched source has caught up
+        """
+        for group in self._groups():
+            if group is None:
+                if idle: yield None
+                continue
+            if self.claims is not None:
+                group = self.claims.claim_group(group)
+                if not group: continue
+            yield group
+
+    def _groups(self) -> Generator[list[str] | None,None,None]:
+        """The groups, and None whenever a watched source has caught up"""
+        if self.grouper is not None:
+            # groups of the scanned files go out as the hashing gets past them, files that show up later are not grouped
+            yield from self.grouper.groups(self.images_iterator(self.index.iter_indices(self.config.order,follow=False)))
+            if self.watcher is not None:
+                for path in self.images_iterator(self.index.iter_added(idle=True)): yield None if path is None else [path]
+        else:
+            for path in self.images_iterator(): yield None if path is None else [path]
+
+    def load_group(self,group:list[str]) -> PreviewPyramid:
+        """A group is represented by the preview of its first file"""
+        return PreviewPyramid(self.load_image(group[0],self.decode_box()))
+
+    def load_image(self,path:str,box:tuple[int,int] | None = None) -> Image.Image:
+        """
+        Decode the file as a preview fitting the configured size (or box), or fetch it from the cache.
+        Videos get a contact sheet as wide as the box instead.
+        Runs on the prefetcher's worker threads, so it must not touch any Tk object
+        """
+        if box is None: box = self.config.size
+        width,height = box
+        video = is_video_file(path)
+        if video: variant = f"{width}:video{self.config.video_keyframes}"
+        else: variant = f"{width}x{height}:{self.config.preview_quality.value}"
+        if self.cache is not None:
+            with self.timer.stage("cache"):
+                cached = self.cache.get(path,variant)
+            if cached is not None: return cached
+
+        if video:
+            # seeking to a handful of keyframes, however big the clip
+            with self.timer.stage("decode"):
+                image = video_preview(path,width,self.config.video_keyframes)
+        else:
+            image = load_preview(path,width,self.config.preview_quality,self.timer,height)
+        if self.cache is not None: self.cache.put(path,variant,image)
+        return image
 
     def _get_bindings_list(self) -> tk.Frame:
         """Get a frame that contains a grid of labels showing the bindings"""
@@ -162,17 +614,56 @@ class SortingDialog:
         frame.columnconfigure(0,weight=2) # folder column
 
         # rows generation + row responsiveness configuration
-        for i,(key,folder) in enumerate(self.config.dest.items()):
+        for i,key in enumerate(self.config.dest):
             frame.rowconfigure(i,weight=1)
             tk.Label(master=frame,text=key,relief=tk.GROOVE,padx=10).grid(row=i,column=0) # key label
-            tk.Label(master=frame,text=folder,relief=tk.GROOVE).grid(row=i,column=1) # key label
+            tk.Label(master=frame,text=" + ".join(self.config.targets(key)),relief=tk.GROOVE).grid(row=i,column=1) # key label
 
         return frame
 
+    def _close_pipeline(self):
+        """Stop the background work and flush whatever has to be persisted"""
+        self._stop_video()
+        if self.watcher is not None: self.watcher.close()
+        self.prefetcher.close()
+        self._startup.shutdown(wait=False,cancel_futures=True)
+        self.index.close()
+        if self.content is not None: self.content.close()
+        if self.grouper is not None: self.grouper.close()
+        if self.fileops.pending:
+            print(f"Waiting for {self.fileops.pending} file operations to finish")
+        self.fileops.close()
+        # the prefetched files nobody saw go back to the other operators
+        if self.claims is not None: self.claims.close()
+        # nothing can be undone anymore, the overwritten files can go
+        if self.undo_log is not None:
+            for op in self.expired: discard_backup(op)
+            for decision in self.undo_log:
+                for op in decision.ops: discard_backup(op)
+        if self._undo_pool is not None: self._undo_pool.shutdown(wait=False)
+        if self._zoom_pool is not None: self._zoom_pool.shutdown(wait=False,cancel_futures=True)
+        if self.journal is not None:
+            self.journal.close()
+            # undone decisions and done records are only needed until the session ends
+            compact(self.journal.path)
+        if self.cache is not None: self.cache.close()
+        if self.config.timing_export is not None:
+            self.timer.export(self.config.timing_export)
+            print(f"Timings written to {self.config.timing_export}")
+
     def _quit(self):
+        # let the user know why the window doesn't close right away
+        if self.fileops.pending:
+            self.lab_status.configure(text=f"Finishing {self.fileops.pending} file operations...")
+            self.window.update_idletasks()
+        self._close_pipeline()
         self.window.destroy()
 
 
 def open_sorting_window(config: InstanceConfig):
     """Show the user a media sieving dialog"""
-    SortingDialog(config)
\ No newline at end of file
+    if config.grid is not None:
+        from .grid import GridSortingDialog
+        GridSortingDialog(config)
+    else:
+        SortingDialog(config)
\ No newline at end of file
@@ -0,0 +1,42 @@
+import os
+from os import path
+import sqlite3
+import threading
+
+class SQLiteCache:
+    """
+    Values computed from files, in an SQLite table keyed by absolute path, modification time and size,
+    so that a changed file is never matched with what was computed from its old content.
+    Safe to use from several threads. None as the location keeps it in memory only
+    """
+
+    def __init__(self, location: str | None, table:str, columns:list[str]) -> None:
+        """columns: names of the values stored for each file"""
+        if location is None:
+            location = ":memory:"
+        else:
+            os.makedirs(path.dirname(path.abspath(location)),exist_ok=True)
+        self.table = table
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(location,check_same_thread=False,isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL") # losing the last entries in a crash only costs recomputing them
+        self._db.execute(f"""CREATE TABLE IF NOT EXISTS {table} (
+            path TEXT, mtime, size INTEGER, {", ".join(columns)},
+            PRIMARY KEY (path, mtime, size))""")
+
+    def get(self, key:tuple, column:str) -> tuple | None:
+        """(value,) of column for the (path, mtime, size) key, None if nothing was stored for that file"""
+        with self._lock:
+            return self._db.execute(
+                f"SELECT {column} FROM {self.table} WHERE path=? AND mtime=? AND size=?",key
+            ).fetchone()
+
+    def set(self, key:tuple, column:str, value):
+        with self._lock:
+            self._db.execute(f"INSERT OR IGNORE INTO {self.table} (path, mtime, size) VALUES (?,?,?)",key)
+            self._db.execute(f"UPDATE {self.table} SET {column}=? WHERE path=? AND mtime=? AND size=?",(value,*key))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,283 @@
+from dataclasses import dataclass
+from PIL import Image
+import json
+import mmap
+import os
+from os import path
+import threading
+import time
+
+try:
+    import fcntl # only used to coordinate several processes sharing one cache
+except ImportError:
+    fcntl = None
+
+PACK_NAME = "previews.pack"
+LOG_NAME = "index.log"
+LOCK_NAME = "lock"
+
+STORED_MODES = {"RGB","RGBA","L","LA"}
+"""Modes that can be stored as raw bytes without a palette or other side information"""
+
+def default_cache_dir() -> str:
+    """Per-user cache location (XDG on Unix, LOCALAPPDATA on Windows)"""
+    base = os.environ.get("XDG_CACHE_HOME") or os.environ.get("LOCALAPPDATA")
+    if not base: base = path.join(path.expanduser("~"),".cache")
+    return path.join(base,"visieve")
+
+def cache_key(filepath:str, variant:str, stat: os.stat_result | None = None) -> str:
+    """
+    Key of a preview: absolute path, modification time and size of the source file,
+    plus a variant string describing the rendering (target size, quality...)
+    """
+    if stat is None: stat = os.stat(filepath)
+    return f"{path.abspath(filepath)}|{stat.st_mtime_ns}|{stat.st_size}|{variant}"
+
+@dataclass
+class _Entry:
+    offset: int
+    length: int
+    mode: str
+    size: tuple[int,int]
+    last_used: float
+
+class ThumbnailCache:
+    """
+    Persistent preview cache made of an append-only pack file holding the raw pixels
+    and an append-only log describing where each preview lives in the pack.
+    The pack is memory-mapped for reading, so a hit costs a single memory copy and no decoding.
+    Least recently used previews are dropped once the live data exceeds the budget,
+    and the pack gets rewritten in the background when too much of it is dead space.
+    Several processes can share one directory
+    """
+
+    directory: str
+    budget: int
+    """Maximum amount of bytes of live previews to keep on disk"""
+
+    def __init__(self, directory:str, budget:int = 1024**3) -> None:
+        self.directory = directory
+        self.budget = budget
+        os.makedirs(directory,exist_ok=True)
+        self._pack_path = path.join(directory,PACK_NAME)
+        self._log_path = path.join(directory,LOG_NAME)
+        self._lock_path = path.join(directory,LOCK_NAME)
+        self._lock = threading.RLock()
+        self._map: mmap.mmap | None = None
+        self._touched: set[str] = set() # keys hit during this session
+        self._compactor: threading.Thread | None = None
+        self._reload()
+
+    # --- index bookkeeping ---
+
+    def _reload(self):
+        """(Re)build the in memory index from scratch"""
+        if self._map is not None: self._map.close()
+        self._map = None
+        self._entries: dict[str,_Entry] = {}
+        self._log_pos = 0
+        self._live_bytes = 0
+        for f in (self._pack_path,self._log_path): open(f,"ab").close()
+        self._pack_inode = os.stat(self._pack_path).st_ino
+        self._catch_up()
+
+    def _catch_up(self):
+        """Read the log records appended (possibly by other processes) since the last read"""
+        pack_size = os.path.getsize(self._pack_path)
+        with open(self._log_path,"rb") as log:
+            log.seek(self._log_pos)
+            for line in log:
+                if not line.endswith(b"\n"): break # torn write, retry on the next catch up
+                self._log_pos += len(line)
+                try:
+                    self._apply(json.loads(line),pack_size)
+                except (ValueError,KeyError,TypeError):
+                    continue # corrupted line, e.g. after a crash
+
+    def _apply(self, record:dict, pack_size:int):
+        key = record["key"]
+        old = self._entries.pop(key,None)
+        if old is not None: self._live_bytes -= old.length
+        match record["op"]:
+            case "put":
+                entry = _Entry(record["offset"],record["length"],record["mode"],tuple(record["size"]),record["time"])
+                if entry.offset + entry.length > pack_size: return
+                self._entries[key] = entry
+                self._live_bytes += entry.length
+            case "touch":
+                if old is not None:
+                    old.last_used = max(old.last_used,record["time"])
+                    self._entries[key] = old
+                    self._live_bytes += old.length
+            case "drop":
+                pass
+
+    def _check_generation(self):
+        """Another process may have compacted the pack, in which case all offsets changed"""
+        try:
+            inode = os.stat(self._pack_path).st_ino
+        except FileNotFoundError:
+            inode = None
+        if inode != self._pack_inode: self._reload()
+
+    def _file_lock(self):
+        return _FileLock(self._lock_path)
+
+    # --- public interface ---
+
+    def get(self, filepath:str, variant:str, stat: os.stat_result | None = None) -> Image.Image | None:
+        """Returns the cached preview of filepath, or None if it's not (or no longer) in the cache"""
+        try:
+            key = cache_key(filepath,variant,stat)
+        except OSError:
+            return None
+        with self._lock:
+            self._check_generation()
+            entry = self._entries.get(key)
+            if entry is None:
+                self._catch_up()
+                entry = self._entries.get(key)
+                if entry is None: return None
+
+            end = entry.offset + entry.length
+            if self._map is None or len(self._map) < end:
+                if self._map is not None: self._map.close()
+                with open(self._pack_path,"rb") as pack:
+                    self._map = mmap.mmap(pack.fileno(),0,access=mmap.ACCESS_READ)
+                if len(self._map) < end: return None
+            data = self._map[entry.offset:end]
+            entry.last_used = time.time()
+            self._touched.add(key)
+        return Image.frombytes(entry.mode,entry.size,data)
+
+    def put(self, filepath:str, variant:str, image:Image.Image, stat: os.stat_result | None = None):
+        """Store image as the preview of filepath"""
+        if image.mode not in STORED_MODES:
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+        data = image.tobytes()
+        if len(data) > self.budget: return
+        try:
+            key = cache_key(filepath,variant,stat)
+        except OSError:
+            return
+
+        with self._lock, self._file_lock():
+            self._check_generation()
+            self._catch_up()
+            with open(self._pack_path,"ab") as pack:
+                offset = pack.seek(0,os.SEEK_END)
+                pack.write(data)
+            self._append_log([{
+                "op":"put", "key":key, "offset":offset, "length":len(data),
+                "mode":image.mode, "size":list(image.size), "time":time.time()
+            }])
+            self._evict()
+
+    def _append_log(self, records:list[dict]):
+        """Append records to the log and apply them to the in memory index"""
+        with open(self._log_path,"ab") as log:
+            log.write(b"".join(json.dumps(r).encode()+b"\n" for r in records))
+        self._catch_up()
+
+    def _evict(self):
+        """Drop the least recently used previews until the budget is respected"""
+        if self._live_bytes > self.budget:
+            by_age = sorted(self._entries.items(),key=lambda kv: kv[1].last_used)
+            drops = []
+            excess = self._live_bytes - self.budget
+            for key,entry in by_age:
+                if excess <= 0: break
+                drops.append({"op":"drop","key":key})
+                excess -= entry.length
+            self._append_log(drops)
+
+        # the pack only grows, rewrite it once most of it is unreachable
+        if self._compactor is None and os.path.getsize(self._pack_path) > 2 * max(self._live_bytes,self.budget):
+            self._compactor = threading.Thread(target=self._compact,daemon=True,name="visieve-cache-compact")
+            self._compactor.start()
+
+    def _compact(self):
+        """
+        Rewrite pack and log with only the live previews, most recently used first.
+        The pack is append-only, so the bulk of the copy reads it without holding any lock,
+        the previews written in the meantime are copied once both locks are held again
+        """
+        tmp_pack = f"{self._pack_path}.{os.getpid()}.tmp"
+        tmp_log = f"{self._log_path}.{os.getpid()}.tmp"
+        try:
+            with self._lock:
+                self._check_generation()
+                self._catch_up()
+                inode = self._pack_inode
+                live = sorted(self._entries.items(),key=lambda kv: kv[1].last_used,reverse=True)
+
+            moved: dict[tuple[str,int],int] = {} # (key, old offset) -> new offset
+            with open(self._pack_path,"rb") as src, open(tmp_pack,"wb") as pack:
+                for key,entry in live:
+                    moved[key,entry.offset] = pack.tell()
+                    src.seek(entry.offset)
+                    pack.write(src.read(entry.length))
+
+                with self._lock, self._file_lock():
+                    self._check_generation()
+                    if self._pack_inode != inode: return # another process compacted it meanwhile
+                    self._catch_up()
+                    records = []
+                    for key,entry in self._entries.items():
+                        offset = moved.get((key,entry.offset))
+                        if offset is None:
+                            offset = pack.tell()
+                            src.seek(entry.offset)
+                            pack.write(src.read(entry.length))
+                        records.append({
+                            "op":"put", "key":key, "offset":offset, "length":entry.length,
+                            "mode":entry.mode, "size":list(entry.size), "time":entry.last_used
+                        })
+                    pack.flush()
+                    with open(tmp_log,"wb") as log:
+                        log.write(b"".join(json.dumps(r).encode()+b"\n" for r in records))
+                    os.replace(tmp_pack,self._pack_path)
+                    os.replace(tmp_log,self._log_path)
+                    self._reload()
+        except OSError as e:
+            print(f"Could not compact the preview cache: {e}")
+        finally:
+            for tmp in (tmp_pack,tmp_log):
+                try:
+                    os.remove(tmp)
+                except FileNotFoundError:
+                    pass
+            with self._lock:
+                self._compactor = None
+
+    def close(self):
+        """Wait for a running compaction, then persist the recency of the previews used in this session"""
+        compactor = self._compactor
+        if compactor is not None: compactor.join()
+        with self._lock:
+            if self._touched:
+                now = time.time()
+                with self._file_lock():
+                    self._check_generation()
+                    self._append_log([{"op":"touch","key":k,"time":now} for k in self._touched if k in self._entries])
+                self._touched.clear()
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+
+
+class _FileLock:
+    """Exclusive lock on a file, shared between processes (no-op where fcntl is not available)"""
+    def __init__(self, lock_path:str) -> None:
+        self.lock_path = lock_path
+        self._file = None
+    def __enter__(self):
+        if fcntl is not None:
+            self._file = open(self.lock_path,"ab")
+            fcntl.flock(self._file.fileno(),fcntl.LOCK_EX)
+        return self
+    def __exit__(self, *exc):
+        if self._file is not None:
+            fcntl.flock(self._file.fileno(),fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
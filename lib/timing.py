@@ -0,0 +1,121 @@
+from array import array
+from contextlib import nullcontext
+import csv
+import json
+import statistics
+import time
+
+STAGES = ("scan","cache","open","decode","resize","photoimage","redraw","zoom","video","name_conflict","file_op")
+"""
+Stages of the sorting pipeline that get timed, in pipeline order. photoimage only covers new images
+put on screen, redraw the same image shown again (resized window, grid selection, zoomed view),
+zoom the rendering of a zoomed view and video the frames of a playing video
+"""
+
+_NULL = nullcontext()
+
+class _Measure:
+    """Context manager that records the time spent in its block"""
+    __slots__ = ("timer","stage","start")
+    def __init__(self, timer:"StageTimer", stage:str) -> None:
+        self.timer = timer
+        self.stage = stage
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    def __exit__(self, *exc):
+        self.timer.record(self.stage,time.perf_counter() - self.start)
+
+class StageTimer:
+    """
+    Per-stage timings kept in fixed size ring buffers (one pair of arrays per stage),
+    so recording never allocates and old samples are simply overwritten.
+    When disabled, stage() hands out a shared no-op context manager and record() returns right away
+    """
+
+    def __init__(self, enabled:bool = True, capacity:int = 4096) -> None:
+        self.enabled = enabled
+        self.capacity = capacity
+        self.started = time.time()
+        self._durations = { s: array("d",bytes(8*capacity)) for s in STAGES } if enabled else {}
+        self._ends = { s: array("d",bytes(8*capacity)) for s in STAGES } if enabled else {}
+        self._counts = dict.fromkeys(STAGES,0)
+        self._sorted = array("d",bytes(8*capacity)) if enabled else array("d") # when each image got sorted
+        self._sorted_count = 0
+
+    def stage(self, stage:str):
+        """with timer.stage("decode"): ..."""
+        if not self.enabled: return _NULL
+        return _Measure(self,stage)
+
+    def record(self, stage:str, seconds:float):
+        if not self.enabled: return
+        i = self._counts[stage] % self.capacity
+        self._durations[stage][i] = seconds
+        self._ends[stage][i] = time.time()
+        self._counts[stage] += 1
+
+    def sorted(self, images:int = 1):
+        """Record that images got sorted, the throughput images_per_minute reports"""
+        if not self.enabled: return
+        now = time.time()
+        for _ in range(images):
+            self._sorted[self._sorted_count % self.capacity] = now
+            self._sorted_count += 1
+
+    def samples(self, stage:str) -> list[tuple[float,float]]:
+        """(end time, duration) of the samples still in the buffer, oldest first"""
+        if not self.enabled: return []
+        count = self._counts[stage]
+        if count <= self.capacity:
+            indices = range(count)
+        else:
+            start = count % self.capacity
+            indices = [*range(start,self.capacity),*range(start)]
+        return [ (self._ends[stage][i],self._durations[stage][i]) for i in indices ]
+
+    def summary(self, stage:str) -> dict | None:
+        """p50/p95 (ms) of the buffered samples of stage, None if there are none"""
+        durations = sorted(d for _,d in self.samples(stage))
+        if not durations: return None
+        return {
+            "count": self._counts[stage],
+            "p50_ms": statistics.median(durations) * 1000,
+            "p95_ms": durations[min(len(durations)-1,int(len(durations)*0.95))] * 1000,
+        }
+
+    def images_per_minute(self, window:float = 60) -> float:
+        """Images sorted per minute, over the last window seconds"""
+        now = time.time()
+        recent = self._sorted[:min(self._sorted_count,self.capacity)]
+        done = sum(1 for t in recent if now - t <= window)
+        span = min(window,now - self.started)
+        return done * 60 / span if span > 0 else 0
+
+    def overlay_text(self) -> str:
+        """Short multi-line report for the on-screen overlay"""
+        lines = [f"{self.images_per_minute():.1f} images/min"]
+        for stage in STAGES:
+            s = self.summary(stage)
+            if s is not None: lines.append(f"{stage}: p50 {s['p50_ms']:.1f} ms, p95 {s['p95_ms']:.1f} ms")
+        return "\n".join(lines)
+
+    def export(self, filepath:str):
+        """Write every buffered sample to filepath, as JSON if it ends in .json, as CSV otherwise"""
+        if filepath.lower().endswith(".json"):
+            data = {
+                "started": self.started,
+                "images_per_minute": self.images_per_minute(time.time() - self.started),
+                "summary": { s: self.summary(s) for s in STAGES },
+                "samples": { s: self.samples(s) for s in STAGES },
+            }
+            with open(filepath,"w") as f: json.dump(data,f,indent=1)
+        else:
+            with open(filepath,"w",newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(["stage","end_time","seconds"])
+                for stage in STAGES:
+                    for end,seconds in self.samples(stage): writer.writerow([stage,f"{end:.6f}",f"{seconds:.6f}"])
+
+DISABLED = StageTimer(enabled=False)
+"""Default timer of every component, records nothing"""
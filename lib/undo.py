@@ -0,0 +1,60 @@
+from .fileops import FileOperation
+from .prefetch import image_bytes
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Hashable
+
+@dataclass
+class Decision:
+    """What a single keypress did, enough to take it back"""
+    group: list[str]
+    key: str
+    ops: list[FileOperation] = field(default_factory=list)
+    """The operations submitted for the group, files dropped by the duplicate policy have none"""
+
+class UndoLog:
+    """The last depth decisions, most recent last"""
+
+    def __init__(self, depth:int = 50) -> None:
+        self.depth = depth
+        self._decisions: deque[Decision] = deque()
+
+    def __len__(self) -> int:
+        return len(self._decisions)
+
+    def __iter__(self):
+        return iter(self._decisions)
+
+    def push(self, decision: Decision) -> Decision | None:
+        """Record decision, returns the oldest one if it no longer fits (it can't be undone anymore)"""
+        self._decisions.append(decision)
+        if len(self._decisions) > self.depth: return self._decisions.popleft()
+        return None
+
+    def pop(self) -> Decision | None:
+        """Take the most recent decision out, None if there is none"""
+        return self._decisions.pop() if self._decisions else None
+
+class PreviewLRU:
+    """
+    Recently displayed previews by path (or any other key, e.g. zoom tiles),
+    the least recently used are dropped past budget bytes
+    """
+
+    def __init__(self, budget:int = 128 * 1024**2) -> None:
+        self.budget = budget
+        self.used = 0
+        self._items: OrderedDict[Hashable,object] = OrderedDict()
+
+    def put(self, key:Hashable, preview):
+        if key in self._items: self.used -= image_bytes(self._items.pop(key))
+        self._items[key] = preview
+        self.used += image_bytes(preview)
+        while self.used > self.budget and len(self._items) > 1:
+            _,dropped = self._items.popitem(last=False)
+            self.used -= image_bytes(dropped)
+
+    def get(self, key:Hashable):
+        preview = self._items.get(key)
+        if preview is not None: self._items.move_to_end(key)
+        return preview
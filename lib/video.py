@@ -0,0 +1,109 @@
+from .preview import fit_width
+from PIL import Image
+import importlib.util
+import queue
+import threading
+
+cv2 = None
+"""OpenCV, imported by the first video opened: importing it takes longer than starting the window"""
+
+def videos_supported() -> bool:
+    """True if OpenCV is installed (optional, videos are left out of the sorting if it's missing)"""
+    return cv2 is not None or importlib.util.find_spec("cv2") is not None
+
+def _load_opencv():
+    global cv2
+    if cv2 is not None: return
+    try:
+        cv2 = importlib.import_module("cv2")
+    except ImportError:
+        raise RuntimeError("OpenCV is needed to open videos")
+
+def _to_image(frame) -> Image.Image:
+    return Image.fromarray(cv2.cvtColor(frame,cv2.COLOR_BGR2RGB))
+
+def video_preview(path:str, width:int, frames:int = 1) -> Image.Image:
+    """
+    Preview of a video: frames evenly spaced frames side by side, width pixels wide in total.
+    Only seeks to the needed positions (the container index takes the decoder to the nearest
+    keyframe), so the size of the clip doesn't matter
+    """
+    _load_opencv()
+    capture = cv2.VideoCapture(str(path))
+    try:
+        if not capture.isOpened(): raise ValueError(f"Cannot open video {path}")
+        fps = capture.get(cv2.CAP_PROP_FPS) or 25
+        duration_ms = capture.get(cv2.CAP_PROP_FRAME_COUNT) / fps * 1000
+        shots = []
+        for i in range(max(1,frames)):
+            if duration_ms > 0: capture.set(cv2.CAP_PROP_POS_MSEC,duration_ms * (i + 0.5) / max(1,frames))
+            ok,frame = capture.read()
+            if ok: shots.append(_to_image(frame))
+        if not shots:
+            # some containers can't seek, fall back on the very first frame
+            capture.set(cv2.CAP_PROP_POS_FRAMES,0)
+            ok,frame = capture.read()
+            if not ok: raise ValueError(f"Cannot decode video {path}")
+            shots.append(_to_image(frame))
+    finally:
+        capture.release()
+
+    tile_width = max(1,width // len(shots))
+    tiles = [ shot.resize(fit_width(shot.size,tile_width),Image.BILINEAR) for shot in shots ]
+    sheet = Image.new("RGB",(tile_width * len(tiles),max(t.height for t in tiles)))
+    for i,tile in enumerate(tiles): sheet.paste(tile,(i * tile_width,0))
+    return sheet
+
+class VideoPlayer:
+    """
+    Decodes a video at a low frame rate on a background thread, looping at the end.
+    Frames are resized there and wait in a small queue, the Tk side only polls frame()
+    """
+
+    def __init__(self, path:str, width:int, fps:float = 8, buffered:int = 8) -> None:
+        _load_opencv()
+        self.path = path
+        self.width = width
+        self.fps = fps
+        self._frames: queue.Queue = queue.Queue(maxsize=buffered)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._decode,daemon=True,name="visieve-video")
+        self._thread.start()
+
+    def _decode(self):
+        capture = cv2.VideoCapture(str(self.path))
+        try:
+            source_fps = capture.get(cv2.CAP_PROP_FPS) or 25
+            step = max(1,round(source_fps / self.fps)) # source frames per shown frame
+            while not self._stop.is_set():
+                for _ in range(step - 1):
+                    if not capture.grab(): break # skip without decoding
+                ok,frame = capture.read()
+                if not ok:
+                    capture.set(cv2.CAP_PROP_POS_FRAMES,0) # loop
+                    ok,frame = capture.read()
+                    if not ok: return
+                image = _to_image(frame)
+                image = image.resize(fit_width(image.size,self.width),Image.BILINEAR)
+                while not self._stop.is_set():
+                    try:
+                        self._frames.put(image,timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+        finally:
+            capture.release()
+
+    def frame(self) -> Image.Image | None:
+        """Next decoded frame, None if the decoder is behind"""
+        try:
+            return self._frames.get_nowait()
+        except queue.Empty:
+            return None
+
+    @property
+    def interval_ms(self) -> int:
+        return int(1000 / self.fps)
+
+    def stop(self):
+        self._stop.set()
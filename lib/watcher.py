@@ -0,0 +1,194 @@
+from .indexer import SourceIndex
+from typing import Iterable
+import ctypes
+import ctypes.util
+import os
+from os import path
+import select
+import struct
+import sys
+import threading
+import time
+
+# inotify(7) event masks
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+EVENT_HEADER = struct.Struct("iIII")
+"""wd, mask, cookie, len, followed by len bytes of NUL padded name"""
+
+def _load_inotify():
+    """The libc inotify functions, or None where they are not available"""
+    if not sys.platform.startswith("linux"): return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6",use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int,ctypes.c_char_p,ctypes.c_uint32]
+        return libc
+    except (OSError,AttributeError):
+        return None
+
+class SourceWatcher:
+    """
+    Keeps appending the files that appear in the source of a SourceIndex, while it is open.
+    With inotify, files are added once their writer closes them (or once they are renamed into the source),
+    so half written files never show up. Without it (or with polling=True, for network shares)
+    the source is listed every interval seconds and new files are added once their size and
+    modification time have not changed for settle seconds.
+    Files inside the exclude directories (e.g. destinations within a recursive source) are ignored
+    """
+
+    def __init__(self,
+            index: SourceIndex,
+            exclude: Iterable[str] = (),
+            interval: float = 1.0,
+            settle: float = 2.0,
+            polling: bool = False) -> None:
+        self.index = index
+        self.interval = interval
+        self.settle = settle
+        self.exclude = { path.normcase(path.abspath(d)) for d in exclude }
+        self._known: set[str] = set()
+        self._watches: dict[int,str] = {}
+        self._stop = threading.Event()
+        self._fd = None
+
+        libc = None if polling else _load_inotify()
+        if libc is not None:
+            fd = libc.inotify_init1(IN_CLOEXEC)
+            if fd >= 0:
+                self._libc = libc
+                self._fd = fd
+                # watches go in before the scan is over, so nothing written meanwhile is missed
+                self._watch_tree(index.source)
+        self.mode = "inotify" if self._fd is not None else "polling"
+
+        index.set_live(True)
+        self._thread = threading.Thread(target=self._run,daemon=True,name="visieve-watch")
+        self._thread.start()
+
+    def _excluded(self, directory:str) -> bool:
+        return path.normcase(path.abspath(directory)) in self.exclude
+
+    def _directories(self, top:str) -> list[str]:
+        """top, plus its subdirectories if the index is recursive (same rules as the scan)"""
+        if self._excluded(top): return []
+        if not self.index.recursive: return [top]
+        found = []
+        for dirpath,dirnames,_ in os.walk(top):
+            dirnames[:] = [ d for d in dirnames if not d.startswith(".") and not self._excluded(path.join(dirpath,d)) ]
+            found.append(dirpath)
+        return found
+
+    def _watch_tree(self, top:str):
+        for directory in self._directories(top):
+            wd = self._libc.inotify_add_watch(self._fd,os.fsencode(directory),IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE)
+            if wd < 0:
+                print(f"Cannot watch {directory}: {os.strerror(ctypes.get_errno())}")
+                continue
+            self._watches[wd] = directory
+
+    def _offer(self, filepath:str, stat: os.stat_result | None = None):
+        """Add filepath to the index, unless it is already there or not a media file"""
+        if filepath in self._known: return
+        name = path.basename(filepath)
+        if name.startswith(".") or not self.index.accepts(name): return
+        try:
+            if stat is None: stat = os.stat(filepath)
+        except OSError:
+            return # already gone
+        if not path.isfile(filepath): return
+        self._known.add(filepath)
+        print(f"New file {filepath}")
+        self.index.add_file(filepath,stat.st_mtime,stat.st_size)
+
+    def _run(self):
+        # everything the scan found is known, only what comes after it is new
+        self.index.wait()
+        self._known.update(self.index.paths)
+        if self._fd is not None:
+            self._inotify_loop()
+        else:
+            self._poll_loop()
+
+    def _inotify_loop(self):
+        while not self._stop.is_set():
+            ready,_,_ = select.select([self._fd],[],[],0.5)
+            if not ready: continue
+            try:
+                data = os.read(self._fd,64 * 1024)
+            except OSError:
+                return # closed
+            offset = 0
+            while offset < len(data):
+                wd,mask,_cookie,length = EVENT_HEADER.unpack_from(data,offset)
+                name = data[offset+EVENT_HEADER.size:offset+EVENT_HEADER.size+length].rstrip(b"\0")
+                offset += EVENT_HEADER.size + length
+                if mask & IN_Q_OVERFLOW:
+                    # events got lost, listing the source is the only way to find the missing files
+                    print("Too many new files at once, watching the source by polling from now on")
+                    self._close_fd()
+                    return self._poll_loop()
+                if mask & IN_IGNORED:
+                    self._watches.pop(wd,None) # the directory is gone
+                    continue
+                directory = self._watches.get(wd)
+                if directory is None or not name: continue
+                filepath = path.join(directory,os.fsdecode(name))
+                if mask & IN_ISDIR:
+                    if self.index.recursive and not os.fsdecode(name).startswith("."):
+                        self._watch_tree(filepath)
+                        # files that landed before the watch was in place
+                        for subdir in self._directories(filepath):
+                            for entry in self._list(subdir): self._offer(*entry)
+                elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                    self._offer(filepath)
+
+    def _list(self, directory:str) -> list[tuple[str,os.stat_result]]:
+        """(path, stat) of the media files in directory"""
+        found = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if not self.index.accepts(entry.name) or not entry.is_file(): continue
+                        found.append((entry.path,entry.stat()))
+                    except OSError:
+                        continue
+        except OSError:
+            pass
+        return found
+
+    def _poll_loop(self):
+        candidates: dict[str,tuple[tuple[int,float],float]] = {} # path -> (size, mtime), unchanged since
+        while not self._stop.wait(self.interval):
+            now = time.monotonic()
+            seen = set()
+            for directory in self._directories(self.index.source):
+                for filepath,stat in self._list(directory):
+                    if filepath in self._known: continue
+                    seen.add(filepath)
+                    signature = (stat.st_size,stat.st_mtime)
+                    previous = candidates.get(filepath)
+                    if previous is None or previous[0] != signature:
+                        candidates[filepath] = (signature,now) # still being written
+                    elif now - previous[1] >= self.settle:
+                        del candidates[filepath]
+                        self._offer(filepath,stat)
+            for filepath in candidates.keys() - seen: del candidates[filepath]
+
+    def _close_fd(self):
+        if self._fd is None: return
+        os.close(self._fd)
+        self._fd = None
+
+    def close(self):
+        """Stop watching, the index iterators end once they reach the last entry"""
+        self._stop.set()
+        self._thread.join(timeout=2)
+        self._close_fd()
+        self.index.set_live(False)
@@ -0,0 +1,216 @@
+from .preview import PreviewPyramid, check_decode, open_image
+from .undo import PreviewLRU
+from concurrent.futures import Future, ThreadPoolExecutor
+from PIL import Image
+import math
+
+TILE = 256
+"""Side of the square tiles the zoomed image is rendered in"""
+FULL_LEVEL_PIXELS = 16 * 1024**2
+"""Levels up to this size are cut into tiles all at once, even when the format can decode regions"""
+MAX_ZOOM = 4.0
+"""Screen pixels per image pixel at the deepest zoom"""
+RAW_BYTES_PER_PIXEL = { "1": None, "L": 1, "P": None, "LA": 2, "I;16": 2, "I;16B": 2, "RGB": 3, "RGBA": 4, "CMYK": 4 }
+
+def _region_tiles(image_file:Image.Image, box:tuple[int,int,int,int]) -> tuple[list,tuple[int,int,int,int]] | None:
+    """
+    Tile descriptors that decode only the part of image_file around box (relative to the area they cover),
+    and that area, or None if the format can't do that. Only uncompressed data is addressed directly:
+    tiled or striped TIFFs (one descriptor per tile) and single-strip raw data. Compressed TIFFs
+    are handed to libtiff as a single tile by Pillow, so they get decoded whole like a JPEG
+    """
+    # a bare rawmode (e.g. PPM) means rows of that mode top to bottom, without padding
+    tiles = [ (t[0],t[1],t[2],(t[3],0,1) if isinstance(t[3],str) else t[3]) for t in image_file.tile ]
+    if not tiles or any(t[0] != "raw" for t in tiles): return None
+    if any(not isinstance(t[3],tuple) or len(t[3]) < 3 or t[3][2] != 1 or RAW_BYTES_PER_PIXEL.get(t[3][0]) is None for t in tiles):
+        return None # bottom-up rows, separate planes, bit depths that don't fill a byte
+    if len(tiles) > 1:
+        chosen = [ t for t in tiles if t[1][0] < box[2] and t[1][2] > box[0] and t[1][1] < box[3] and t[1][3] > box[1] ]
+        if not chosen: return None
+        area = (min(t[1][0] for t in chosen),min(t[1][1] for t in chosen),max(t[1][2] for t in chosen),max(t[1][3] for t in chosen))
+        return [ (t[0],(t[1][0]-area[0],t[1][1]-area[1],t[1][2]-area[0],t[1][3]-area[1]),*t[2:]) for t in chosen ],area
+
+    name,extents,offset,args = tiles[0]
+    if extents != (0,0,*image_file.size): return None
+    stride = args[1] or image_file.width * RAW_BYTES_PER_PIXEL[args[0]]
+    area = (0,box[1],image_file.width,box[3])
+    return [(name,(0,0,image_file.width,box[3]-box[1]),offset + box[1]*stride,args)],area
+
+def _read_tiles(filepath:str, mode:str, tiles:list, area:tuple[int,int,int,int]) -> Image.Image:
+    """Read the raw tiles given by _region_tiles straight from the file and put them together"""
+    check_decode((area[2]-area[0],area[3]-area[1]))
+    region = Image.new(mode,(area[2]-area[0],area[3]-area[1]))
+    with open(filepath,"rb") as f:
+        for _name,(x0,y0,x1,y1),offset,args in tiles:
+            rawmode,stride = args[:2]
+            stride = stride or (x1-x0) * RAW_BYTES_PER_PIXEL[rawmode]
+            f.seek(offset)
+            data = f.read(stride*(y1-y0))
+            region.paste(Image.frombytes(mode,(x1-x0,y1-y0),data,"raw",rawmode,stride,1),(x0,y0))
+    return region
+
+def decode_region(filepath:str, box:tuple[int,int,int,int], scale:int) -> Image.Image:
+    """
+    The box (full resolution coordinates) of the image at filepath, shrunk by scale.
+    Only the needed part is read where the format allows it, otherwise the whole image is decoded
+    at the smallest scale the codec supports (JPEG draft) and cropped
+    """
+    target = (max(1,math.ceil((box[2]-box[0])/scale)),max(1,math.ceil((box[3]-box[1])/scale)))
+    with open_image(filepath) as image_file:
+        mode = image_file.mode
+        region = _region_tiles(image_file,box)
+    if region is not None:
+        tiles,area = region
+        try:
+            inner = (box[0]-area[0],box[1]-area[1],box[2]-area[0],box[3]-area[1])
+            return _read_tiles(filepath,mode,tiles,area).crop(inner).convert("RGB").resize(target,Image.BILINEAR,reducing_gap=2.0)
+        except (OSError,ValueError):
+            pass # truncated file or unusual layout, decode it the regular way below
+
+    with open_image(filepath) as image_file:
+        full = image_file.size
+        image_file.draft(image_file.mode,(math.ceil(full[0]/scale),math.ceil(full[1]/scale)))
+        check_decode(image_file.size)
+        image_file.load()
+        # the codec may have scaled it already, translate the box into its coordinates
+        f = image_file.width / full[0]
+        scaled = (int(box[0]*f),int(box[1]*f),math.ceil(box[2]*f),math.ceil(box[3]*f))
+        return image_file.crop(scaled).convert("RGB").resize(target,Image.BILINEAR,reducing_gap=2.0)
+
+def render_tiles(
+        filepath:str,
+        size:tuple[int,int],
+        level:int,
+        wanted:list[tuple[int,int]],
+        budget:int | None = None) -> dict[tuple[int,int],Image.Image]:
+    """
+    Render the wanted (column,row) tiles of the given level (the image shrunk by 2**level) with a single decode.
+    When that decode covers the whole image anyway (small levels, formats that can't decode regions like JPEG),
+    the other tiles are cut from it too, nearest to the wanted ones first and within half of budget bytes,
+    so that panning around needs no more decoding
+    """
+    scale = 2**level
+    level_size = (math.ceil(size[0]/scale),math.ceil(size[1]/scale))
+    whole = level_size[0]*level_size[1] <= FULL_LEVEL_PIXELS
+    if not whole:
+        with open_image(filepath) as image_file:
+            whole = _region_tiles(image_file,(0,0,*size)) is None
+    if whole:
+        others = [ (c,r) for c in range(math.ceil(level_size[0]/TILE)) for r in range(math.ceil(level_size[1]/TILE)) ]
+        if budget is not None:
+            cx,cy = sum(c for c,_ in wanted)/len(wanted),sum(r for _,r in wanted)/len(wanted)
+            others.sort(key=lambda t: (t[0]-cx)**2 + (t[1]-cy)**2)
+            others = others[:budget // 2 // (TILE*TILE*3)]
+        wanted = list(set(wanted) | set(others))
+    c0,r0 = min(c for c,_ in wanted),min(r for _,r in wanted)
+    c1,r1 = max(c for c,_ in wanted)+1,max(r for _,r in wanted)+1
+    box = (c0*TILE*scale,r0*TILE*scale,min(size[0],c1*TILE*scale),min(size[1],r1*TILE*scale))
+    region = decode_region(filepath,box,scale)
+    tiles = {}
+    for c,r in wanted:
+        x,y = (c-c0)*TILE,(r-r0)*TILE
+        tiles[(c,r)] = region.crop((x,y,min(region.width,x+TILE),min(region.height,y+TILE)))
+    return tiles
+
+class ZoomView:
+    """
+    Zoom and pan state over one image. The visible part is rendered from tiles of the pyramid level
+    closest to the zoom (never smaller), tiles are decoded on a thread pool and kept in a shared LRU.
+    Until they arrive, the preview stands in for them, scaled up
+    """
+
+    def __init__(self, filepath:str, preview:PreviewPyramid, tiles:PreviewLRU, pool:ThreadPoolExecutor) -> None:
+        with open_image(filepath) as image_file:
+            self.size = image_file.size # only reads the header
+        self.path = filepath
+        self.preview = preview.levels[0]
+        self.tiles = tiles
+        self.pool = pool
+        self.center = (self.size[0]/2,self.size[1]/2)
+        self.zoom = None # screen pixels per image pixel, set by the first render
+        self._pending: dict[tuple,Future] = {}
+
+    def fit(self, box:tuple[int,int]) -> float:
+        """The zoom that shows the whole image"""
+        return min(box[0]/self.size[0],box[1]/self.size[1])
+
+    def zoom_by(self, factor:float, box:tuple[int,int], anchor:tuple[int,int] | None = None):
+        """Zoom in (factor > 1) or out, keeping the image point under anchor (screen coordinates) still"""
+        current = self.zoom or self.fit(box)
+        zoom = min(MAX_ZOOM,max(self.fit(box),current*factor))
+        if anchor is not None:
+            # image point under the anchor, before and after
+            ax = self.center[0] + (anchor[0]-box[0]/2)/current
+            ay = self.center[1] + (anchor[1]-box[1]/2)/current
+            self.center = (ax - (anchor[0]-box[0]/2)/zoom,ay - (anchor[1]-box[1]/2)/zoom)
+        self.zoom = zoom
+        self._clamp(box)
+
+    def pan(self, dx:float, dy:float, box:tuple[int,int]):
+        """Move the view by dx,dy screen pixels"""
+        zoom = self.zoom or self.fit(box)
+        self.center = (self.center[0] + dx/zoom,self.center[1] + dy/zoom)
+        self._clamp(box)
+
+    def _clamp(self, box:tuple[int,int]):
+        zoom = self.zoom or self.fit(box)
+        half = (box[0]/zoom/2,box[1]/zoom/2)
+        cx = self.size[0]/2 if half[0]*2 >= self.size[0] else min(max(self.center[0],half[0]),self.size[0]-half[0])
+        cy = self.size[1]/2 if half[1]*2 >= self.size[1] else min(max(self.center[1],half[1]),self.size[1]-half[1])
+        self.center = (cx,cy)
+
+    @property
+    def waiting(self) -> bool:
+        """True while tiles are being decoded"""
+        return bool(self._pending)
+
+    def collect(self) -> bool:
+        """Move the finished tiles into the cache, True if any arrived"""
+        arrived = False
+        for key,future in list(self._pending.items()):
+            if not future.done(): continue
+            del self._pending[key]
+            try:
+                for (c,r),tile in future.result().items():
+                    self.tiles.put((self.path,key[0],c,r),tile)
+                arrived = True
+            except Exception as e:
+                print(f"Could not decode {self.path} at level {key[0]}: {e}")
+        return arrived
+
+    def render(self, box:tuple[int,int]) -> Image.Image:
+        """The visible part of the image, box sized. Missing tiles get requested"""
+        if self.zoom is None: self.zoom = self.fit(box)
+        zoom = self.zoom
+        level = max(0,int(math.floor(math.log2(1/zoom)))) if zoom < 1 else 0
+        scale = 2**level
+
+        # visible area in full resolution and in level coordinates
+        x0 = self.center[0] - box[0]/zoom/2
+        y0 = self.center[1] - box[1]/zoom/2
+        x1,y1 = x0 + box[0]/zoom,y0 + box[1]/zoom
+        lx0,ly0 = math.floor(x0/scale),math.floor(y0/scale)
+        lx1,ly1 = math.ceil(x1/scale),math.ceil(y1/scale)
+        canvas_size = (max(1,lx1-lx0),max(1,ly1-ly0))
+
+        # the preview, scaled up, fills in wherever the sharp tiles are missing
+        p = self.preview.width / self.size[0]
+        canvas = self.preview.crop((lx0*scale*p,ly0*scale*p,lx1*scale*p,ly1*scale*p)).resize(canvas_size,Image.BILINEAR)
+
+        missing = []
+        for c in range(max(0,lx0//TILE),math.ceil(min(lx1,math.ceil(self.size[0]/scale))/TILE)):
+            for r in range(max(0,ly0//TILE),math.ceil(min(ly1,math.ceil(self.size[1]/scale))/TILE)):
+                tile = self.tiles.get((self.path,level,c,r))
+                if tile is None: missing.append((c,r))
+                else: canvas.paste(tile,(c*TILE-lx0,r*TILE-ly0))
+        if missing and not any(key[0] == level for key in self._pending):
+            self._pending[(level,tuple(missing))] = self.pool.submit(render_tiles,self.path,self.size,level,missing,self.tiles.budget)
+
+        # the level is never smaller than needed, this only shrinks (or enlarges past 1:1)
+        width = round((lx1-lx0)*scale*zoom)
+        height = round((ly1-ly0)*scale*zoom)
+        image = canvas.resize((max(1,width),max(1,height)),Image.BILINEAR)
+        # areas outside the image (when it's smaller than the box) are already black in the canvas
+        view = Image.new("RGB",box)
+        view.paste(image,(-round((x0 - lx0*scale)*zoom),-round((y0 - ly0*scale)*zoom)))
+        return view
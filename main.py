@@ -1,27 +1,52 @@
 from lib.bind_util import open_bind_dialog
 from lib.sorter import open_sorting_window
+from lib.batch import load_config, run_batch, print_summary
 from lib.datatypes import DuplicateMode, InstanceConfig, SieveMode # remove after completion to mask details from user
+import argparse
 import sys
 
-result = open_bind_dialog()
+def main():
+    # worker processes re-import this module on some platforms, so nothing runs at import time
+    parser = argparse.ArgumentParser(description="Manual image sorting tool")
+    parser.add_argument("--config",help="JSON config file, skips the binding dialog")
+    parser.add_argument("--batch",action="store_true",help="sort with the rules of the config file, without any window")
+    parser.add_argument("--dry-run",action="store_true",help="with --batch, only print what would be done")
+    parser.add_argument("--workers",type=int,default=None,help="with --batch, number of worker processes")
+    parser.add_argument("--fresh",action="store_true",help="start a new session instead of resuming the journaled one")
+    args = parser.parse_args()
 
-result = InstanceConfig(
-    sieve_mode=SieveMode.COPY,
-    duplicate_mode=DuplicateMode.MAINTAIN,
-    source="example/source/",
-    dest={
-        "a": "example/dest1/",
-        "b": "example/dest2/",
-        "c": "example/dest3/"
-    }
-    )
+    if args.batch:
+        if not args.config: parser.error("--batch needs a --config file")
+        config,rules,labels = load_config(args.config)
+        print_summary(run_batch(config,rules,labels,dry_run=args.dry_run,workers=args.workers))
+        return
 
-if not result:
-    print("Configuration object not found. Quitting...")
-    sys.exit()
+    if args.config:
+        result,_rules,_labels = load_config(args.config)
+    else:
+        result = open_bind_dialog()
 
-print("Beginning the sieving process")
+        result = InstanceConfig(
+            sieve_mode=SieveMode.COPY,
+            duplicate_mode=DuplicateMode.MAINTAIN,
+            source="example/source/",
+            dest={
+                "a": "example/dest1/",
+                "b": "example/dest2/",
+                "c": "example/dest3/"
+            }
+            )
 
-open_sorting_window(result)
+    if not result:
+        print("Configuration object not found. Quitting...")
+        sys.exit()
 
-print("Done. Thanks for using visieve!")
\ No newline at end of file
+    if args.fresh: result.resume = False
+    print("Beginning the sieving process")
+
+    open_sorting_window(result)
+
+    print("Done. Thanks for using visieve!")
+
+if __name__ == "__main__":
+    main()